@@ -1,29 +1,95 @@
-import geopandas as gpd
+from __future__ import annotations
+
 import pandas as pd
-from shapely import wkt, Point
 import networkx as nx
-import matplotlib.pyplot as plt
-from geopy.distance import geodesic
-import requests
 import numpy as np
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING
+
+# geopandas, shapely, geopy and matplotlib are imported where they are used:
+# loading the cached graph (load_graph) does not need any of them
+if TYPE_CHECKING:
+    import geopandas as gpd
+    from shapely import Point, STRtree
+
+BARRIS_PATH = "data/barris.csv"
 
-def load_gdf() -> gpd.GeoDataFrame:
-    """Returns the geospatial data of the neighborhoods"""
+# parsed once per process, see get_gdf and get_spatial_index
+_gdf: gpd.GeoDataFrame | None = None
+_spatial_index: STRtree | None = None
+
+def load_gdf(df: pd.DataFrame | None = None) -> gpd.GeoDataFrame:
+    """Returns the geospatial data of the neighborhoods, from df (same columns as data/barris.csv) if given"""
+    import geopandas as gpd
+    from shapely import wkt
 
     # load csv
-    df = pd.read_csv("data/barris.csv")
+    if df is None:
+        df = pd.read_csv(BARRIS_PATH)
+    else:
+        df = df.copy()
     
     df["geometria_wgs84"] = df["geometria_wgs84"].apply(wkt.loads)
     gdf = gpd.GeoDataFrame(df, geometry="geometria_wgs84")
     gdf = gdf.set_crs("EPSG:4326")
     return gdf
 
+def get_gdf() -> gpd.GeoDataFrame:
+    """Returns the geospatial data of the neighborhoods, loading it only the first time"""
+
+    global _gdf
+    if _gdf is None:
+        _gdf = load_gdf()
+    return _gdf
+
+
+def get_spatial_index() -> STRtree:
+    """Returns a spatial index over the neighborhood polygons, in the same order as get_gdf"""
+
+    from shapely import STRtree
+
+    global _spatial_index
+    if _spatial_index is None:
+        _spatial_index = STRtree(get_gdf().geometry.values)
+    return _spatial_index
+
+
+def get_barris(
+    longitudes: np.ndarray,
+    latitudes: np.ndarray,
+    codes: bool = False,
+    chunk_size: int = 100_000,
+) -> np.ndarray:
+    """Returns the name (or codi_barri if codes) of the neighborhood that contains each point, None if no neighborhood does.
+    Points are processed chunk_size at a time so memory stays flat for millions of points"""
+    from shapely import points
+
+    longitudes = np.asarray(longitudes, dtype=float)
+    latitudes = np.asarray(latitudes, dtype=float)
+    values = get_gdf()["codi_barri" if codes else "nom_barri"].to_numpy()
+    tree = get_spatial_index()
+
+    result = np.full(len(longitudes), None, dtype=object)
+    for start in range(0, len(longitudes), chunk_size):
+        chunk_points = points(
+            longitudes[start : start + chunk_size], latitudes[start : start + chunk_size]
+        )
+        point_index, barri_index = tree.query(chunk_points, predicate="within")
+
+        # if polygons overlap keep the first neighborhood, like get_barri
+        order = np.argsort(-barri_index, kind="stable")
+        result[start + point_index[order]] = values[barri_index[order]]
+    return result
+
+
 def get_barri(point: Point, gdf: gpd.GeoDataFrame = None) -> str | None:
     """Returns the neighborhood that cointains a given point"""
 
     # uses shapely.geometry.Point(x, y) with the coordinates
     if gdf is None:
-        gdf = load_gdf()
+        return get_barris([point.x], [point.y])[0]
     match = gdf[gdf.contains(point)]
     try:
         return match["nom_barri"].iloc[0]
@@ -31,9 +97,19 @@ def get_barri(point: Point, gdf: gpd.GeoDataFrame = None) -> str | None:
         return None
 
 
+def representative_points(gdf: gpd.GeoDataFrame | None = None) -> pd.DataFrame:
+    """Returns the name, latitude and longitude of a point inside every neighborhood, the same points used as graph positions"""
+
+    if gdf is None:
+        gdf = get_gdf()
+    points = gdf.geometry.representative_point()
+    return pd.DataFrame({"nom_barri": gdf["nom_barri"].values, "lat": points.y.values, "lon": points.x.values})
+
+
 def create_graph(draw: bool = False) -> nx.Graph:
     """Creates a Graph where nodes are neighbourhoods and
     edges exist if neighbourhoods are adjacent"""
+    from geopy.distance import geodesic
 
     G = nx.Graph()
     gdf = load_gdf()
@@ -69,6 +145,8 @@ def create_graph(draw: bool = False) -> nx.Graph:
 
     # Visualization, can be deleted
     if draw:
+        import matplotlib.pyplot as plt
+
         ax = gdf.plot(figsize=(10, 10), color="lightgrey", edgecolor="black")
         gdf["rep_point"].plot(ax=ax, color="red", markersize=30)
         pos = {
@@ -85,3 +163,43 @@ def create_graph(draw: bool = False) -> nx.Graph:
         )
         plt.show()
     return G
+
+
+
+def barris_hash() -> str:
+    """Returns a hash of the contents of data/barris.csv"""
+
+    with open(BARRIS_PATH, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def load_graph() -> nx.Graph:
+    """Returns the same graph as create_graph. The graph is stored in a small json file keyed by
+    the hash of data/barris.csv, so the polygons are only parsed again when the csv changes"""
+
+    path = f"data/graph_{barris_hash()}.json"
+
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+        G = nx.Graph()
+        for name, codi_barri in data["nodes"]:
+            G.add_node(name, codi_barri=codi_barri)
+        for a, b, weight in data["edges"]:
+            G.add_edge(a, b, weight=weight, n=0, c=0)
+        return G
+
+    G = create_graph(draw=False)
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "nodes": [
+                    [name, int(codi_barri)]
+                    for name, codi_barri in G.nodes(data="codi_barri")
+                ],
+                "edges": [[a, b, weight] for a, b, weight in G.edges(data="weight")],
+            },
+            f,
+            ensure_ascii=False,
+        )
+    return G
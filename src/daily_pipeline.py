@@ -1,4 +1,6 @@
 import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 from metadata_manager import MetadataManager
 import llm_scraper
@@ -6,8 +8,6 @@ import datetime
 import meteo
 import database_connection
 import pandas as pd
-import joblib
-import tensorflow as tf
 import event_encoder
 import sqlalchemy as sql
 import numpy as np
@@ -43,114 +43,355 @@ def process_scraped_events(df_events: pd.DataFrame, barri_list: list[str]) -> pd
                 
     return pd.DataFrame(processed_events)
 
-def get_lag_features(date: datetime.datetime, barri: str, engine, prediction_cache: dict) -> tuple[float, float, float, float]:
+LAGS = [7, 14, 21, 28]
+WEEKDAYS = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+LATENT_DIM = 5
+WEATHER_COLUMNS = ["temperature_2m_max", "temperature_2m_min", "precipitation_sum"]
+HOLIDAYS_PATH = "data/all_holidays.csv"  # holiday calendar used in training
+
+FEATURES = [
+    "barri",
+    "temperature_2m_max",
+    "temperature_2m_min",
+    "precipitation_sum",
+    "is_holiday",
+    "month_cat",
+    "day_cat",
+    "lag_7",
+    "lag_14",
+    "lag_21",
+    "lag_28",
+    "dt_7_w1",
+    "dt_7_w2",
+    "enc1",
+    "enc2",
+    "enc3",
+    "enc4",
+    "enc5",
+]
+
+
+def load_lag_table(first_day: datetime.datetime, last_day: datetime.datetime, barri_list: list[str], engine) -> pd.DataFrame:
     """
-    Returns tuples with the intensity 7, 14, 21 and 28 days back.
-    Checks local cache first, then DB. Gracefully handles individually missing lags.
+    Returns a table indexed by day (YYYY-MM-DD) with one column per barri holding the intensities
+    stored in display_data that can be lags of days first_day to last_day. Uses a single query.
     """
-    lags = []
-    available_lags = []
-    
-    # Calculate the exact 4 target dates
-    target_dates = [
-        (date - datetime.timedelta(days=7)).strftime("%Y-%m-%d"),
-        (date - datetime.timedelta(days=14)).strftime("%Y-%m-%d"),
-        (date - datetime.timedelta(days=21)).strftime("%Y-%m-%d"),
-        (date - datetime.timedelta(days=28)).strftime("%Y-%m-%d")
-    ]
-    
-    # Identify which dates we need to fetch from the DB (i.e., not in our local cache)
-    dates_to_query = [d for d in target_dates if (d, barri) not in prediction_cache]
-    
-    db_lags = {}
-    if dates_to_query:
-        dates_formatted = ", ".join([f"'{d}'" for d in dates_to_query])
-        query = f"""
-            SELECT DATE(day) as day_date, intensity
-            FROM display_data 
-            WHERE DATE(day) IN ({dates_formatted}) AND barri = :barri;
-        """
-        df_db = pd.read_sql_query(sql.text(query), con=engine, params={"barri": barri})
-        
-        # Map DB results to a dictionary for easy lookup
-        for _, row in df_db.iterrows():
-            date_key = row['day_date'].strftime("%Y-%m-%d") if isinstance(row['day_date'], datetime.date) else str(row['day_date'])
-            db_lags[date_key] = row['intensity']
-            
-    # Cache -> DB -> Missing
-    for target_d in target_dates:
-        if (target_d, barri) in prediction_cache:
-            val = prediction_cache[(target_d, barri)]
-            lags.append(val)
-            available_lags.append(val)
-        elif target_d in db_lags:
-            val = db_lags[target_d]
-            lags.append(val)
-            available_lags.append(val)
-        else:
-            lags.append(None) 
-            
-    # Impute missing lags with the mean 
-    mean_val = sum(available_lags) / len(available_lags) if available_lags else 0.0
-    lags = [val if val is not None else mean_val for val in lags]
-    
-    return tuple(lags)
+    start_str = (first_day - datetime.timedelta(days=max(LAGS))).strftime("%Y-%m-%d")
+    end_str = (last_day - datetime.timedelta(days=min(LAGS) - 1)).strftime("%Y-%m-%d")
+
+    # compare day directly (no DATE(day)) so an index on day can be used
+    query = """
+        SELECT day, barri, intensity
+        FROM display_data
+        WHERE day >= :start AND day < :end;
+    """
+    df_db = pd.read_sql_query(sql.text(query), con=engine, params={"start": start_str, "end": end_str})
+    df_db["day"] = pd.to_datetime(df_db["day"]).dt.strftime("%Y-%m-%d")
 
+    lag_table = df_db.pivot_table(index="day", columns="barri", values="intensity", aggfunc="last")
+    return lag_table.reindex(columns=barri_list).astype(float)
 
-def main() -> None:
+
+def get_lag_features(date: datetime.datetime, lag_table: pd.DataFrame) -> np.ndarray:
     """
-    Executes pipeline, made to be executed daily, updates data in DB
+    Returns an array of shape (barris, 4) with the intensity 7, 14, 21 and 28 days back for every barri of the lag table.
+    Missing lags are imputed with the mean of the available lags of the barri (0 if there are none).
+    """
+    target_dates = [(date - datetime.timedelta(days=lag)).strftime("%Y-%m-%d") for lag in LAGS]
+    lags = lag_table.reindex(target_dates).to_numpy().T
+
+    # Impute missing lags with the mean
+    missing = np.isnan(lags)
+    available = (~missing).sum(axis=1)
+    mean_val = np.divide(np.nansum(lags, axis=1), available, out=np.zeros(len(lags)), where=available > 0)
+    return np.where(missing, mean_val[:, None], lags)
+
+
+def build_block_features(days: list[datetime.datetime], barri_list: list[str], lag_table: pd.DataFrame, df_weather: pd.DataFrame, festius_dates, barri_weather: meteo.BarriWeather | None = None) -> pd.DataFrame:
+    """
+    Returns the display data (without intensity) of every barri for every day in days, one row per (day, barri).
+    If barri_weather is given, each barri gets its own weather instead of the city one.
+    Raises an exception if df_weather doesn't have the weather of every day
+    """
+    n = len(barri_list)
+    day_strs = [day.strftime("%Y-%m-%d") for day in days]
+    lags = np.vstack([get_lag_features(day, lag_table) for day in days])
+    weather = df_weather.set_index("day").reindex(pd.to_datetime(day_strs))
+    missing_weather = weather[WEATHER_COLUMNS].isna().any(axis=1)
+    if missing_weather.any():
+        # the model would predict from NaN weather without any warning
+        missing_days = ", ".join(weather.index[missing_weather].strftime("%Y-%m-%d"))
+        raise Exception(f"Weather not available for {missing_days}")
+
+    df_block = pd.DataFrame({
+        "day": np.repeat(day_strs, n),
+        "barri": np.tile(barri_list, len(days)),
+        "temperature_2m_max": np.repeat(weather["temperature_2m_max"].to_numpy(), n),
+        "temperature_2m_min": np.repeat(weather["temperature_2m_min"].to_numpy(), n),
+        "precipitation_sum": np.repeat(weather["precipitation_sum"].to_numpy(), n),
+        "month_cat": np.repeat([day.month for day in days], n),
+        "day_cat": np.repeat([WEEKDAYS[day.weekday()] for day in days], n),
+        "lag_7": lags[:, 0],
+        "lag_14": lags[:, 1],
+        "lag_21": lags[:, 2],
+        "lag_28": lags[:, 3],
+        "dt_7_w1": (lags[:, 0] - lags[:, 1]) / 7,
+        "dt_7_w2": (lags[:, 1] - lags[:, 2]) / 7,
+        "is_holiday": np.repeat([int(day_str in festius_dates) for day_str in day_strs], n),
+    })
+
+    if barri_weather is not None:
+        df_block = barri_weather.join(df_block)
+    return df_block
+
+
+def forecast(first_day: datetime.datetime, last_day: datetime.datetime, barri_list: list[str], lag_table: pd.DataFrame, df_weather: pd.DataFrame, festius_dates, encoded_events_df: pd.DataFrame, regressor, barri_weather: meteo.BarriWeather | None = None) -> pd.DataFrame:
+    """
+    Predicts the intensity of every barri from first_day to last_day (inclusive) and returns the display data.
+    The shortest lag is 7 days, so the days of a 7-day block never depend on each other: each block is predicted
+    with a single call and its predictions are added to lag_table to be used as lags by the next blocks.
+    """
+    block_length = min(LAGS)
+    enc_cols = [f"enc{i+1}" for i in range(LATENT_DIM)]
+    all_display_data_frames: list[pd.DataFrame] = []
+
+    block_start = first_day
+    while block_start.date() <= last_day.date():
+        days = [block_start + datetime.timedelta(days=i) for i in range(block_length)]
+        days = [day for day in days if day.date() <= last_day.date()]
+
+        df_block = build_block_features(days, barri_list, lag_table, df_weather, festius_dates, barri_weather)
+
+        df_pred = pd.merge(df_block, encoded_events_df, on=['day', 'barri'], how='left')
+        for col in enc_cols:
+            if col not in df_pred.columns:
+                df_pred[col] = 0.0
+
+        df_pred[enc_cols] = df_pred[enc_cols].fillna(0.0).infer_objects(copy=False)
+
+        df_pred["barri"] = df_pred["barri"].astype(str).astype("category")
+        df_pred["month_cat"] = df_pred["month_cat"].astype(str).astype("category")
+        df_pred["day_cat"] = df_pred["day_cat"].astype(str).astype("category")
+
+        prediction = np.expm1(regressor.predict(df_pred[FEATURES]))
+        df_block["intensity"] = prediction
+
+        # one row of predictions per day of the block
+        for day, day_prediction in zip(days, prediction.reshape(len(days), len(barri_list))):
+            lag_table.loc[day.strftime("%Y-%m-%d")] = day_prediction
+
+        all_display_data_frames.append(df_block)
+        block_start = days[-1] + datetime.timedelta(days=1)
+
+    return pd.concat(all_display_data_frames, ignore_index=True)
+
+
+def load_models(regressor_version: str | None = None):
+    """
+    Returns the regressor and the event encoder. The native artifacts of regressor_version and the lookup table
+    version of the encoder are used when they are available, falling back to the pickled regressor and the keras encoder
+    """
+    import xgb_model
+
+    models_dir = "." if os.environ.get('GITHUB_ACTIONS') == 'true' else "../models"
+
+    regressor_dir = f"{models_dir}/regressor_{regressor_version}"
+    if regressor_version is not None and os.path.exists(f"{regressor_dir}/{xgb_model.MANIFEST_NAME}"):
+        regressor = xgb_model.Multiregressor.load(regressor_dir)
+    else:
+        import joblib
+
+        regressor = joblib.load(f"{models_dir}/regressor.joblib")
+
+    encoder = event_encoder.load_encoder(models_dir)
+    return regressor, encoder
+
+
+def load_holidays(first_day: datetime.datetime, last_day: datetime.datetime) -> np.ndarray:
+    """
+    Returns the holidays (YYYY-MM-DD) from first_day to last_day (inclusive) in the holiday calendar the models are trained with.
+    Raises an exception if the calendar ends before last_day
+    """
+    df_holidays = pd.read_csv(HOLIDAYS_PATH)
+    days = pd.to_datetime(df_holidays["day"])
+    if days.max() < last_day:
+        raise Exception(f"{HOLIDAYS_PATH} ends on {days.max().strftime('%Y-%m-%d')}, add the holidays up to {last_day.strftime('%Y-%m-%d')}")
+    in_range = (days >= first_day) & (days <= last_day)
+    return days[in_range].dt.strftime("%Y-%m-%d").values
+
+
+def load_cached_inputs(first_day: datetime.datetime, last_day: datetime.datetime, engine, today: datetime.datetime) -> tuple[pd.DataFrame, np.ndarray, pd.DataFrame]:
+    """
+    Returns the weather, holidays and events of days first_day to last_day (inclusive). Weather comes from display_data,
+    days without weather there are fetched from the archive before today and the forecast from today. Holidays come from the
+    holiday calendar and events from the events table. Raises an exception if the weather of some day is not available
+    """
+    params = {
+        "start": first_day.strftime("%Y-%m-%d"),
+        "end": (last_day + datetime.timedelta(days=1)).strftime("%Y-%m-%d"),
+    }
+    df_weather = pd.read_sql_query(sql.text("""
+        SELECT day, temperature_2m_max, temperature_2m_min, precipitation_sum
+        FROM display_data
+        WHERE day >= :start AND day < :end;
+    """), con=engine, params=params)
+    df_weather["day"] = pd.to_datetime(df_weather["day"]).dt.normalize()
+    df_weather = df_weather.groupby("day", as_index=False).first().dropna()
+
+    missing_days = pd.date_range(first_day.date(), last_day.date()).difference(df_weather["day"])
+    if len(missing_days) > 0:
+        print(f"Fetching weather for {len(missing_days)} days not stored in display_data")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            weather_futures = submit_weather_requests(executor, missing_days.min().to_pydatetime(), missing_days.max().to_pydatetime(), today)
+        for df_fetched in [future.result() for future in weather_futures]:
+            if df_fetched is not None:
+                df_fetched = df_fetched[df_fetched["day"].isin(missing_days)].dropna()
+                df_weather = pd.concat([df_weather, df_fetched[["day"] + WEATHER_COLUMNS]], ignore_index=True)
+
+        still_missing = missing_days.difference(df_weather["day"])
+        if len(still_missing) > 0:
+            raise Exception(f"Weather not available for {', '.join(still_missing.strftime('%Y-%m-%d'))}")
+
+    df_events = pd.read_sql_query(sql.text("""
+        SELECT day, barri, category, impact
+        FROM events
+        WHERE day >= :start AND day < :end;
+    """), con=engine, params=params)
+
+    return df_weather, load_holidays(first_day, last_day), df_events
+
+
+def load_barri_points(engine) -> pd.DataFrame:
+    """
+    Returns the representative point (nom_barri, lat, lon) of every barri in geospatial_data
+    """
+    import barri_manager
+
+    df_geo = pd.read_sql_query(sql.text("select * from geospatial_data"), con=engine)
+    return barri_manager.representative_points(barri_manager.load_gdf(df_geo))
+
+
+def fetch_barri_weather(engine, start: datetime.datetime, end: datetime.datetime, today: datetime.datetime) -> meteo.BarriWeather | None:
+    """
+    Returns the weather of every barri from start to end (inclusive), using the archive before today and the forecast from today
+    """
+    points = load_barri_points(engine)
+    return meteo.barri_weather_summary(points, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), today)
+
+
+def backfill(start: str, end: str, use_barri_weather: bool = False) -> None:
+    """
+    Re-forecasts every day from start to end (YYYY-MM-DD, inclusive) with the current models, reusing the weather and events
+    already stored in the DB and the holiday calendar, and upserts their display data. Used after retraining or to catch up.
+    With use_barri_weather, each barri gets its own archive weather
     """
-    
     engine = database_connection.connect_to_db()
     manager = MetadataManager(engine)
-    TODAY = datetime.datetime.today()
-    WEEK_AHEAD = TODAY + datetime.timedelta(days=7)
-    weekdays = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
-    
-    
-    
-    if os.environ.get('GITHUB_ACTIONS') == 'true':
-        regressor = joblib.load("regressor.joblib")
-        encoder = tf.keras.models.load_model("encoder.keras")
-    else:
-        regressor = joblib.load("../models/regressor.joblib")
-        encoder = tf.keras.models.load_model("../models/encoder.keras")
-    
-    
-    max_len = int(manager.get("encoder_max_len"))    
-    latent_dim = 5    
-
-    features = [
-        "barri",
-        "temperature_2m_max",
-        "temperature_2m_min",
-        "precipitation_sum",
-        "is_holiday",
-        "month_cat",
-        "day_cat",
-        "lag_7",
-        "lag_14",
-        "lag_21",
-        "lag_28",
-        "dt_7_w1",
-        "dt_7_w2",
-        "enc1",
-        "enc2",
-        "enc3",
-        "enc4",
-        "enc5",
-    ]
+    first_day = datetime.datetime.strptime(start, "%Y-%m-%d")
+    last_day = datetime.datetime.strptime(end, "%Y-%m-%d")
+
+    regressor, encoder = load_models(manager.get("regressor_version"))
+    max_len = int(manager.get("encoder_max_len"))
 
-    
     df_barris = pd.read_sql_query(sql.text("select nom_barri from geospatial_data"), con=engine)
     barri_list = df_barris['nom_barri'].to_list()
+
+    df_weather, festius_dates, df_events = load_cached_inputs(first_day, last_day, engine, datetime.datetime.today())
+    if not df_events.empty:
+        encoded_events_df = event_encoder.predict(df_events, encoder, max_len, LATENT_DIM)
+    else:
+        encoded_events_df = pd.DataFrame(columns=["day", "barri"] + [f"enc{i+1}" for i in range(LATENT_DIM)])
+
+    lag_table = load_lag_table(first_day, last_day, barri_list, engine)
+    # days inside the range are lags of later days in the range, so they are replaced by the new predictions as they are made
+    lag_table = lag_table[lag_table.index < start].copy()
+    barri_weather = fetch_barri_weather(engine, first_day, last_day, datetime.datetime.today()) if use_barri_weather else None
+    display_data = forecast(first_day, last_day, barri_list, lag_table, df_weather, festius_dates, encoded_events_df, regressor, barri_weather)
+
+    database_connection.upsert_df_to_db(display_data, "display_data", ["day", "barri"], engine)
+    print(f"Display data updated from {start} to {end}")
+    database_connection.print_db_stats()
+
+    last_predicted_day = manager.get("last_predicted_day")
+    if last_predicted_day is None or last_predicted_day < end:
+        manager.set("last_predicted_day", end)
+        print("Metadata manager updated")
+
+
+def submit_weather_requests(executor: ThreadPoolExecutor, start: datetime.datetime, end: datetime.datetime, today: datetime.datetime) -> list:
+    """
+    Submits the weather requests from start to end to the executor: the archive for past days and the forecast for the rest.
+    Returns the futures, in date order
+    """
+    futures = []
+    if start.date() < today.date():
+        archive_end = min(end.date(), today.date() - datetime.timedelta(days=1))
+        futures.append(executor.submit(meteo.daily_weather_summary, start=start.strftime("%Y-%m-%d"), end=archive_end.strftime("%Y-%m-%d")))
+    if end.date() >= today.date():
+        forecast_start = max(start.date(), today.date())
+        futures.append(executor.submit(meteo.weather_forecast_1_week, start=forecast_start.strftime("%Y-%m-%d"), end=end.strftime("%Y-%m-%d")))
+    return futures
+
+
+def main(use_barri_weather: bool = False) -> None:
+    """
+    Executes pipeline, made to be executed daily, updates data in DB. Metadata updates are written together at the end.
+    With use_barri_weather, each barri gets its own weather instead of the city one
+    """
+    
+    engine = database_connection.connect_to_db()
+    database_connection.set_stage("metadata")
+    with MetadataManager(engine) as manager:
+        run_daily(engine, manager, use_barri_weather)
+        database_connection.set_stage("metadata")
+    database_connection.print_db_stats()
+
+
+def run_daily(engine, manager: MetadataManager, use_barri_weather: bool = False) -> None:
+    """
+    Runs the daily pipeline with the given engine and metadata manager. With use_barri_weather, each barri gets its own weather
+    """
+    TODAY = datetime.datetime.today()
+    WEEK_AHEAD = TODAY + datetime.timedelta(days=7)
+
+    max_len = int(manager.get("encoder_max_len"))
     last_predicted_date = datetime.datetime.strptime(manager.get("last_predicted_day"), "%Y-%m-%d")
+    should_check_events = datetime.datetime.strptime(manager.get("last_day_event_checked"), "%Y-%m-%d").date() < WEEK_AHEAD.date()
+    should_predict = last_predicted_date.date() < WEEK_AHEAD.date()
+
+    # ------------------- I/O: SCRAPING / WEATHER / BARRIS / MODELS ------------------
+    # all independent, so they run concurrently: the models load while the network calls are in flight
+
+    database_connection.set_stage("io")
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        models_future = database_connection.submit(executor, load_models, manager.get("regressor_version"))
+        barris_future = database_connection.submit(executor, pd.read_sql_query, sql.text("select nom_barri from geospatial_data"), con=engine)
+
+        # events and holidays are extracted in a single browser session
+        scrape_future = None
+        if should_check_events or should_predict:
+            scrape_future = database_connection.submit(executor, llm_scraper.scrape_week_ahead, should_extract_events=should_check_events, should_extract_festius=should_predict)
+
+        weather_futures = []
+        if should_predict:
+            weather_futures = submit_weather_requests(executor, last_predicted_date, WEEK_AHEAD, TODAY)
+
+        barri_weather_future = None
+        if should_predict and use_barri_weather:
+            barri_weather_future = database_connection.submit(executor, fetch_barri_weather, engine, last_predicted_date + datetime.timedelta(days=1), WEEK_AHEAD, TODAY)
+
+        regressor, encoder = models_future.result()
+        barri_list = barris_future.result()['nom_barri'].to_list()
+        df_events, df_festius = scrape_future.result() if scrape_future is not None else (None, None)
+        weather_parts = [future.result() for future in weather_futures]
+        weather_parts = [part for part in weather_parts if part is not None]
+        df_weather = pd.concat(weather_parts, ignore_index=True) if weather_parts else None
+        barri_weather = barri_weather_future.result() if barri_weather_future is not None else None
 
     # ------------------- EVENTS ------------------
     
-    if datetime.datetime.strptime(manager.get("last_day_event_checked"), "%Y-%m-%d").date() < WEEK_AHEAD.date():
-        df_events, _ = llm_scraper.scrape_week_ahead(should_extract_festius=False)
+    database_connection.set_stage("events")
+    if should_check_events:
         df_events_processed = process_scraped_events(df_events, barri_list)
         database_connection.insert_df_to_db(df_events_processed, "events", engine)
         print("Events inserted")
@@ -162,109 +403,42 @@ def main() -> None:
         
     # ----------------------- MAKE PREDICTIONS / WEATHER / HOLIDAYS -----------------
     
-    if last_predicted_date.date() < WEEK_AHEAD.date():
-    
-        start_str = last_predicted_date.strftime("%Y-%m-%d")
-        end_str = WEEK_AHEAD.strftime("%Y-%m-%d")
-        
-        if last_predicted_date < TODAY:
-            df_weather_past = meteo.daily_weather_summary(start=start_str, end=(TODAY - datetime.timedelta(days=1)).strftime("%Y-%m-%d"))
-            df_weather_future = meteo.weather_forecast_1_week(start=TODAY.strftime("%Y-%m-%d"), end=end_str)
-            df_weather = pd.concat([df_weather_past, df_weather_future], ignore_index=True)
-
-        else:
-            df_weather = meteo.weather_forecast_1_week(start=start_str, end=end_str)
+    database_connection.set_stage("predictions")
+    if should_predict:
             
         if df_weather is None:
             print("Error! Unable to retrieve weather data.")
-            df_weather = pd.DataFrame(columns=["temperature_2m_max", "temperature_2m_min", "precipitation_sum"])
+            df_weather = pd.DataFrame(columns=["day", "temperature_2m_max", "temperature_2m_min", "precipitation_sum"])
         else:
             df_weather.columns = [col.split(" ")[0] for col in df_weather.columns]
             print(df_weather)
             
-        _, df_festius = llm_scraper.scrape_week_ahead(should_extract_events=False)    
         festius_dates = df_festius["date"].astype(str).values
     
         if not df_events_processed.empty:
-            encoded_events_df = event_encoder.predict(df_events_processed, encoder, max_len, latent_dim)   
+            encoded_events_df = event_encoder.predict(df_events_processed, encoder, max_len, LATENT_DIM)   
         else:
-            empty_cols = ["day", "barri"] + [f"enc{i+1}" for i in range(latent_dim)]
+            empty_cols = ["day", "barri"] + [f"enc{i+1}" for i in range(LATENT_DIM)]
             encoded_events_df = pd.DataFrame(columns=empty_cols)
     
-        all_display_data_frames: list[dict] = []
-        prediction_cache = {}
-        last_date = last_predicted_date
-        while last_date.date() < WEEK_AHEAD.date():
-            
-            next_date = last_date + pd.Timedelta(days=1)
-            next_date_str = next_date.strftime("%Y-%m-%d")
-            
-            is_holiday = int(next_date_str in festius_dates)
-            
-            current_month = int(next_date.month)
-            current_day = weekdays[next_date.weekday()]
-            
-            daily_t_max = df_weather.loc[df_weather['day'] == next_date, 'temperature_2m_max'].values[0]
-            daily_t_min = df_weather.loc[df_weather['day'] == next_date, 'temperature_2m_min'].values[0]
-            daily_precip = df_weather.loc[df_weather['day'] == next_date, 'precipitation_sum'].values[0]
-
-            daily_data: list[dict] = []
-            
-            for barri in barri_list:
-                lag_7, lag_14, lag_21, lag_28 = get_lag_features(next_date, barri, engine, prediction_cache)
-                
-                dt_7_w1 = (lag_7 - lag_14) / 7
-                dt_7_w2 = (lag_14 - lag_21) / 7
-                
-                daily_data.append({
-                    "day": next_date_str,
-                    "barri": barri,
-                    "temperature_2m_max": daily_t_max,
-                    "temperature_2m_min": daily_t_min,
-                    "precipitation_sum": daily_precip,
-                    "month_cat": current_month,
-                    "day_cat": current_day,
-                    "lag_7": lag_7,
-                    "lag_14": lag_14,
-                    "lag_21": lag_21,
-                    "lag_28": lag_28,
-                    "dt_7_w1": dt_7_w1,
-                    "dt_7_w2": dt_7_w2,
-                    "is_holiday": is_holiday,
-                })
-                
-            df_daily = pd.DataFrame(daily_data)
-            
-            df_pred = pd.merge(df_daily, encoded_events_df, on=['day', 'barri'], how='left')
-            
-            enc_cols = [f"enc{i+1}" for i in range(latent_dim)]
-            for col in enc_cols:
-                if col not in df_pred.columns:
-                    df_pred[col] = 0.0
-                    
-            df_pred[enc_cols] = df_pred[enc_cols].fillna(0.0).infer_objects(copy=False)
-            
-            df_pred["barri"] = df_pred["barri"].astype(str).astype("category")
-            df_pred["month_cat"] = df_pred["month_cat"].astype(str).astype("category")
-            df_pred["day_cat"] = df_pred["day_cat"].astype(str).astype("category")
-            
-            prediction = np.expm1(regressor.predict(df_pred[features]))
-            
-            df_daily["intensity"] = prediction
-            
-            for _, row in df_daily.iterrows():
-                prediction_cache[(row['day'], row['barri'])] = row['intensity']
-                
-            all_display_data_frames.append(df_daily)
-            last_date = next_date
-            
-        final_display_data = pd.concat(all_display_data_frames, ignore_index=True) 
+        # history from the DB, predictions are added as they are made so they can be used as lags
+        first_day = last_predicted_date + datetime.timedelta(days=1)
+        lag_table = load_lag_table(first_day, WEEK_AHEAD, barri_list, engine)
+        final_display_data = forecast(first_day, WEEK_AHEAD, barri_list, lag_table, df_weather, festius_dates, encoded_events_df, regressor, barri_weather)
         print(final_display_data)   
-        database_connection.insert_df_to_db(final_display_data, "display_data", engine)
+        database_connection.upsert_df_to_db(final_display_data, "display_data", ["day", "barri"], engine)
         print("Display data table updated")
         manager.set("last_predicted_day", (WEEK_AHEAD).strftime("%Y-%m-%d"))
         print("Metadata manager updated")
     
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Daily prediction pipeline")
+    parser.add_argument("--backfill", nargs=2, metavar=("START", "END"), help="re-forecast the days from START to END (YYYY-MM-DD)")
+    parser.add_argument("--barri-weather", action="store_true", help="use the weather of each barri instead of the city one")
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill(*args.backfill, use_barri_weather=args.barri_weather)
+    else:
+        main(use_barri_weather=args.barri_weather)
\ No newline at end of file
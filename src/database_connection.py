@@ -1,4 +1,8 @@
+import contextvars
+import io
 import os
+import threading
+from concurrent.futures import Executor, Future
 import dotenv
 import sqlalchemy as sql
 import pandas as pd
@@ -6,18 +10,101 @@ from meteo import daily_weather_summary, TODAY
 
 dotenv.load_dotenv()
 
+# pool settings, can be tuned from the environment
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 5))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 300))  # seconds, the Supabase pooler drops idle connections
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))  # seconds waiting for a free connection
+STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 120_000))  # milliseconds
+
+# the engine is shared by the whole process
+_engine: sql.Engine | None = None
+_engine_lock = threading.Lock()
+
+# connections checked out and queries run in each stage of the program. The stage belongs to the context that set it,
+# so threads started from one stage keep counting in it when the main thread moves to the next one
+_stage: contextvars.ContextVar[str] = contextvars.ContextVar("db_stage", default="default")
+_stats: dict[str, dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def set_stage(stage: str) -> None:
+    """Sets the stage that the following connections and queries of the current context are counted in"""
+    _stage.set(stage)
+
+
+def submit(executor: Executor, function, *args, **kwargs) -> Future:
+    """Submits function to executor in a copy of the current context, so its connections and queries are counted in the
+    stage it was submitted from"""
+    return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+
+def _count(counter: str) -> None:
+    """Adds one to counter in the current stage"""
+    with _stats_lock:
+        stats = _stats.setdefault(_stage.get(), {"checkouts": 0, "queries": 0})
+        stats[counter] += 1
+
+
+def get_db_stats() -> dict[str, dict[str, int]]:
+    """Returns the connections checked out and queries run in each stage"""
+    with _stats_lock:
+        return {stage: dict(stats) for stage, stats in _stats.items()}
+
+
+def print_db_stats() -> None:
+    """Prints the connections checked out and queries run in each stage"""
+    for stage, stats in get_db_stats().items():
+        print(f"DB {stage}: {stats['checkouts']} connections checked out, {stats['queries']} queries")
+
+
+def _on_begin(conn) -> None:
+    """Sets the statement timeout of every transaction. A session setting would not hold behind the transaction-mode
+    pooler, where every transaction can run on a different backend"""
+    # on the raw cursor, so it is not counted as a query
+    cursor = conn.connection.dbapi_connection.cursor()
+    cursor.execute(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT}")
+    cursor.close()
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    _count("checkouts")
+
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    _count("queries")
+
+
+def create_engine() -> sql.Engine:
+    """Creates an engine for the Supabase pool with the pool settings, a statement timeout and the stage counters"""
+    db_url = f"postgresql+pg8000://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    engine = sql.create_engine(
+        db_url,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_recycle=POOL_RECYCLE,
+        pool_timeout=POOL_TIMEOUT,
+        pool_pre_ping=True,
+    )
+    sql.event.listen(engine, "begin", _on_begin)
+    sql.event.listen(engine, "checkout", _on_checkout)
+    sql.event.listen(engine, "before_cursor_execute", _on_execute)
+    return engine
+
 
 def connect_to_db() -> sql.Engine:
-    """Generates a connection to the Supabase pool. Returns engine object.
+    """Returns the engine of the process, connected to the Supabase pool. It is created on the first call.
 
     Returns:
         sql.Engine: Engine object.
     """
+    global _engine
     try:
-        db_url = f"postgresql+pg8000://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
-        engine = sql.create_engine(db_url)
-        print("Engine connection successful.")
-        return engine
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine()
+                print("Engine connection successful.")
+        return _engine
     except Exception as e:
         print("Could not connect to pool.")
         raise e
@@ -90,4 +177,46 @@ def insert_df_to_db(df: pd.DataFrame, table: str, engine) -> None:
             original_error = getattr(e, 'orig', e)
             print(f"Failed to upload data. Root cause: {original_error}")
             exit()
-    
+
+
+def upsert_df_to_db(df: pd.DataFrame, table: str, keys: list[str], engine) -> tuple[int, int]:
+    """
+    Upserts a given DataFrame into a DB table on the key columns. The rows are streamed with COPY into a temporary
+    staging table, then existing rows are updated and new ones inserted, all in a single transaction so reruns are safe.
+    Returns the number of rows inserted and updated
+    """
+
+    print("Upserting data to", table)
+    # only the last row of each key is kept, as the same row can't be updated twice
+    df = df.drop_duplicates(subset=keys, keep="last")
+    columns = ", ".join(f'"{col}"' for col in df.columns)
+    values = ", ".join(f'"{col}" = s."{col}"' for col in df.columns if col not in keys)
+    matches = " AND ".join(f't."{key}" = s."{key}"' for key in keys)
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    try:
+        with engine.begin() as conn:
+            # statements on the raw cursor are not seen by the engine events, the upsert is counted as one query
+            _count("queries")
+            cursor = conn.connection.cursor()
+            cursor.execute(f'CREATE TEMP TABLE staging (LIKE "{table}" INCLUDING DEFAULTS) ON COMMIT DROP')
+            # empty unquoted fields are NULL in CSV format
+            cursor.execute(f"COPY staging ({columns}) FROM STDIN WITH (FORMAT csv)", stream=buffer)
+
+            # without a unique constraint on the keys, concurrent upserts could insert the same row twice
+            cursor.execute(f'LOCK TABLE "{table}" IN SHARE ROW EXCLUSIVE MODE')
+            cursor.execute(f'UPDATE "{table}" t SET {values} FROM staging s WHERE {matches}')
+            updated = cursor.rowcount
+            cursor.execute(f'INSERT INTO "{table}" ({columns}) SELECT {columns} FROM staging s WHERE NOT EXISTS (SELECT 1 FROM "{table}" t WHERE {matches})')
+            inserted = cursor.rowcount
+
+    except Exception as e:
+            original_error = getattr(e, 'orig', e)
+            print(f"Failed to upload data. Root cause: {original_error}")
+            exit()
+
+    print(f"{inserted} rows inserted and {updated} rows updated in {table}")
+    return inserted, updated
@@ -1,14 +1,19 @@
-from keras import layers, Model
-import keras
+from __future__ import annotations
+
 import numpy as np
 import pandas as pd
 import os
-import tensorflow as tf
 import metadata_manager
+from typing import TYPE_CHECKING
+
+# keras and tensorflow are only imported to build, train or load the keras model
+if TYPE_CHECKING:
+    import keras
 
 
-@keras.saving.register_keras_serializable()
 def apply_masking_logic(args):
+    import tensorflow as tf
+
     dense_output, original_cats = args
     # create mask in order to remove dense layer biases for 0 vectors
     mask = tf.math.not_equal(original_cats, 0)
@@ -17,13 +22,33 @@ def apply_masking_logic(args):
     return dense_output * mask
 
 
-@keras.saving.register_keras_serializable()
 def sum_axis(x):
+    import tensorflow as tf
+
     return tf.reduce_sum(x, axis=1)
 
 
+def register_custom_objects() -> None:
+    """Registers the functions used by the Lambda layers, needed to build or load the keras encoder"""
+    import keras
+
+    for function in [apply_masking_logic, sum_axis]:
+        keras.saving.register_keras_serializable()(function)
+
+
+def load_keras_encoder(path: str) -> keras.Model:
+    """Loads the keras encoder stored in path"""
+    import keras
+
+    register_custom_objects()
+    return keras.models.load_model(path)
+
+
 def additive_encoder(num_categories: int, latent_dim: int = 5):
     """Returns two models: the encoder itself and the whole model that can be trained (encoder + "deencoding" outputs)"""
+    from keras import layers, Model
+
+    register_custom_objects()
     # input event category for each event (not a string but an ID)
     input_event = layers.Input(shape=(None,), name="input_event")
     # input the impact for each event
@@ -65,10 +90,122 @@ def additive_encoder(num_categories: int, latent_dim: int = 5):
     return model, encoder
 
 
+class LookupEncoder:
+    """NumPy version of the encoder built by additive_encoder. Since the encoder adds up one vector per event
+    and then applies a linear layer, the encoding of a group of events is the bias plus the sum of the precomputed
+    latent contribution of each (category, impact) pair. Has the same predict interface as the keras encoder"""
+
+    contributions: np.ndarray  # output of the second dense layer for every (category, impact), category 0 is masked
+    latent_weights: np.ndarray  # weights of the latent_vector layer
+    latent_bias: np.ndarray  # bias of the latent_vector layer
+
+    def __init__(
+        self,
+        contributions: np.ndarray,
+        latent_weights: np.ndarray,
+        latent_bias: np.ndarray,
+    ):
+        self.contributions = contributions
+        self.latent_weights = latent_weights
+        self.latent_bias = latent_bias
+        # latent contribution of every (category, impact) pair
+        self.table = contributions @ latent_weights
+
+    @classmethod
+    def from_keras(cls, encoder: keras.Model, max_impact: int = 5) -> "LookupEncoder":
+        """Precomputes the contribution of every category and every integer impact from 0 to max_impact"""
+        from keras import layers
+
+        embedding = next(l for l in encoder.layers if isinstance(l, layers.Embedding))
+        dense_1, dense_2 = [
+            l
+            for l in encoder.layers
+            if isinstance(l, layers.Dense) and l.name != "latent_vector"
+        ]
+        latent_weights, latent_bias = encoder.get_layer("latent_vector").get_weights()
+
+        emb = embedding.get_weights()[0]
+        num_categories = emb.shape[0]
+        impacts = np.arange(max_impact + 1, dtype="float32")
+
+        # every (category, impact) pair, same input as the concatenate layer
+        x = np.concatenate(
+            [
+                np.repeat(emb, len(impacts), axis=0),
+                np.tile(impacts, num_categories)[:, None],
+            ],
+            axis=1,
+        )
+        for dense in [dense_1, dense_2]:
+            w, b = dense.get_weights()
+            x = np.maximum(x @ w + b, 0)  # relu
+
+        contributions = x.reshape(num_categories, len(impacts), -1)
+        contributions[0] = 0  # masked events
+        return cls(contributions, latent_weights, latent_bias)
+
+    @classmethod
+    def load(cls, path: str) -> "LookupEncoder":
+        """Loads an encoder stored with save"""
+
+        with np.load(path) as data:
+            return cls(
+                data["contributions"], data["latent_weights"], data["latent_bias"]
+            )
+
+    def save(self, path: str) -> None:
+        """Stores the encoder as a .npz file"""
+
+        np.savez(
+            path,
+            contributions=self.contributions,
+            latent_weights=self.latent_weights,
+            latent_bias=self.latent_bias,
+        )
+
+    def predict(self, x: dict[str, np.ndarray], batch_size: int = None, verbose: int = 0) -> np.ndarray:
+        """Returns the encoding of every group of events, same input and output as the keras encoder.
+        Impacts are rounded to the closest integer from 0 to max_impact"""
+
+        cats = np.asarray(x["input_event"], dtype="int64")
+        impacts = np.asarray(x["input_impact"]).reshape(cats.shape)
+        # the table only has integer impacts from 0 to max_impact, other values use the closest one
+        impact_ids = np.clip(np.rint(impacts), 0, self.table.shape[1] - 1).astype("int64")
+
+        return self.latent_bias + self.table[cats, impact_ids].sum(axis=1)
+
+
+def load_encoder(models_dir: str) -> keras.Model | LookupEncoder:
+    """Returns the lookup table version of the encoder stored in models_dir, or the keras encoder if the table
+    was not saved (models trained before it existed)"""
+    if os.path.exists(f"{models_dir}/encoder_table.npz"):
+        return LookupEncoder.load(f"{models_dir}/encoder_table.npz")
+    return load_keras_encoder(f"{models_dir}/encoder.keras")
+
+
+def check_lookup_encoder(
+    encoder: keras.Model, lookup: LookupEncoder, max_len: int, n: int = 1000
+) -> float:
+    """Compares both encoders on n random groups of events and returns the maximum absolute difference"""
+
+    rng = np.random.default_rng(0)
+    num_categories, num_impacts = lookup.table.shape[:2]
+    X_cat = rng.integers(0, num_categories, size=(n, max_len)).astype("int32")
+    X_imp = rng.integers(1, num_impacts, size=(n, max_len, 1)).astype("float32")
+    X_imp[X_cat == 0] = 0
+
+    x = {"input_event": X_cat, "input_impact": X_imp}
+    expected = encoder.predict(x=x, batch_size=1024, verbose=0)
+    return float(np.max(np.abs(expected - lookup.predict(x))))
+
+
 def predict(
-    event_data: pd.DataFrame, encoder: keras.Model, max_len: int, latent_dim: int
+    event_data: pd.DataFrame,
+    encoder: keras.Model | LookupEncoder,
+    max_len: int,
+    latent_dim: int,
 ) -> pd.DataFrame:
-    """Given an event DataFrame, returns a DataFrame with encoded events"""
+    """Given an event DataFrame, returns a DataFrame with encoded events. The encoder can be the keras model or a LookupEncoder"""
     spacetime_to_events: dict[tuple[str, str], list[tuple[str, float]]] = {}
 
     for i, row in event_data.iterrows():
@@ -190,6 +327,13 @@ def main(manager: metadata_manager.MetadataManager) -> None:
     os.makedirs("models/", exist_ok=True)
     encoder.save("models/encoder.keras")
 
+    # store the lookup table version, which does not need tensorflow
+    lookup = LookupEncoder.from_keras(encoder)
+    max_diff = check_lookup_encoder(encoder, lookup, max_len)
+    if max_diff > 1e-3:
+        raise Exception(f"Lookup encoder differs from the keras encoder by {max_diff}")
+    lookup.save("models/encoder_table.npz")
+
     manager.set("encoder_max_len", str(max_len))
 
     # encode event data and output to csv
@@ -1,12 +1,19 @@
+from __future__ import annotations
+
+import datetime
+import json
 import pandas as pd
 import numpy as np
-import xgb_model as xgb_model
 from peak_classifier import peak_loss, peak_loss_over_under
-from sklearn.metrics import mean_absolute_error
 import metadata_manager
-import joblib
+import meteo
+import event_encoder
 import sqlalchemy as sql
-import keras
+from typing import TYPE_CHECKING
+
+# xgboost, scikit-learn and joblib are only imported by the training functions
+if TYPE_CHECKING:
+    import xgb_model
 
 
 # min_loss stores the smallest loss seen in the grid search
@@ -25,6 +32,9 @@ def grid_search(
     test: pd.DataFrame,
 ) -> None:
     """Performs a grid search. Custom function in order to implement custom hyperparameters"""
+    import xgb_model
+    from sklearn.metrics import mean_absolute_error
+
     if index != len(hyperspace):
         # we need to select more hyperparams
         for param in hyperspace[index]:
@@ -81,16 +91,15 @@ def grid_search(
             min_loss = loss
             print("New minimum loss achieved:", min_loss)
 
-            # store accuracies in metadata
-            manager.set("model_accuracy", 1 - loss)
+            # store accuracies and best hyperparameters in metadata, written in one transaction
             over, under = peak_loss_over_under(peak_loss_df)
-            manager.set("model_error_over", over)
-            manager.set("model_error_under", under)
-
-            # store best hyperparameters
-            manager.set("best_base", base)
-            manager.set("best_learning_rate", learning_rate)
-            manager.set("best_depth", depth)
+            with manager:
+                manager.set("model_accuracy", 1 - loss)
+                manager.set("model_error_over", over)
+                manager.set("model_error_under", under)
+                manager.set("best_base", base)
+                manager.set("best_learning_rate", learning_rate)
+                manager.set("best_depth", depth)
 
 
 def train_best(
@@ -100,6 +109,9 @@ def train_best(
     test: pd.DataFrame,
 ) -> xgb_model.Multiregressor:
     """Trains model with best chosen hyperparameters"""
+    import xgb_model
+    import joblib
+
     # unpack
     base = int(manager.get("best_base"))
     learning_rate = manager.get("best_learning_rate")
@@ -127,8 +139,15 @@ def train_best(
         depth,
     )
 
-    # save model
+    # save model, both pickled and as native versioned artifacts registered in the metadata
     joblib.dump(model, "models/regressor.joblib")
+    version = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    training_window = (train["day"].min().strftime("%Y-%m-%d"), test["day"].max().strftime("%Y-%m-%d"))
+    manifest = model.save(f"models/regressor_{version}", version, training_window)
+    with manager:
+        manager.set("regressor_version", version)
+        manager.set("regressor_manifest", json.dumps(manifest))
+    print(f"Saved regressor version {version}")
     return model
 
 
@@ -152,7 +171,7 @@ def calculate_sample_weights(df: pd.DataFrame, base: float) -> pd.Series:
 
 def load_events(df: pd.DataFrame, manager: metadata_manager.MetadataManager) -> pd.DataFrame:
     """Returns DataFrame with all events and holidays added"""
-    encoder = keras.models.load_model("models/encoder.keras")
+    encoder = event_encoder.load_encoder("models")
     encoder_max_len = int(manager.get("encoder_max_len"))
 
     # predict no events (need bias)
@@ -190,9 +209,12 @@ def create_features(
     data: pd.DataFrame,
     manager: metadata_manager.MetadataManager,
     drop_empty: bool = True,
+    barri_weather: meteo.BarriWeather | None = None,
 ) -> pd.DataFrame:
-    """Returns a DataFrame with the additional features"""
+    """Returns a DataFrame with the additional features. If barri_weather is given, each barri gets its own weather instead of the city one"""
     df = data.copy()
+    if barri_weather is not None:
+        df = barri_weather.join(df)
 
     # add day of the week
     day_int_to_name = {
@@ -0,0 +1,133 @@
+"""Reports the time it takes to import every module in src, each one in a fresh interpreter, and
+checks it against a time budget. Heavy frameworks must only be imported by the code paths that need them.
+
+Usage: python import_report.py [--budget SECONDS] [module ...]
+Exits with status 1 if a module goes over the budget or imports a heavy framework at import time, or if the modules of
+the daily pipeline import scikit-learn."""
+
+import argparse
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MODULES = [
+    "barri_manager",
+    "daily_pipeline",
+    "database_connection",
+    "event_encoder",
+    "example_data",
+    "hyperparameter_optimizer",
+    "intensities",
+    "llm_scraper",
+    "metadata_manager",
+    "meteo",
+    "peak_classifier",
+    "xgb_model",
+]
+
+# frameworks that take seconds to import
+HEAVY_FRAMEWORKS = [
+    "tensorflow",
+    "keras",
+    "xgboost",
+    "sklearn",
+    "joblib",
+    "geopandas",
+    "matplotlib",
+    "playwright",
+    "google.genai",
+]
+
+# modules the daily pipeline imports, scikit-learn is only needed to train
+DAILY_PATH = ["daily_pipeline", "event_encoder", "xgb_model"]
+
+DEFAULT_BUDGET = 1.0  # seconds
+
+
+def import_times(module: str) -> list[tuple[int, str, float]]:
+    """Imports module in a fresh interpreter and returns (nesting level, package, cumulative seconds) for every package it imported"""
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not import {module}: {result.stderr.strip().splitlines()[-1]}")
+
+    times: list[tuple[int, str, float]] = []
+    for line in result.stderr.splitlines():
+        # format: "import time: self [us] | cumulative | <2 spaces per level>package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append((level, name.strip(), int(cumulative) / 1e6))
+    return times
+
+
+def report(module: str, budget: float) -> bool:
+    """Prints the import cost of module and its slowest direct imports. Returns whether it passes the check"""
+
+    times = import_times(module)
+    total = next(t for level, name, t in times if level == 0 and name == module)
+
+    imported = {name for _, name, _ in times}
+    heavy = [framework for framework in HEAVY_FRAMEWORKS if framework in imported]
+
+    # direct imports of the module are nested one level under it and listed before it
+    module_index = next(
+        i for i, (level, name, _) in enumerate(times) if level == 0 and name == module
+    )
+    direct: list[tuple[str, float]] = []
+    for level, name, t in reversed(times[:module_index]):
+        if level == 0:
+            break
+        if level == 1:
+            direct.append((name, t))
+    slowest = sorted(direct, key=lambda x: -x[1])[:3]
+
+    passed = total <= budget and not heavy
+    print(
+        f"{'OK  ' if passed else 'FAIL'} {module:<26} {total:6.3f}s  "
+        + ", ".join(f"{name} {t:.3f}s" for name, t in slowest)
+        + (f"  heavy: {', '.join(heavy)}" if heavy else "")
+    )
+    return passed
+
+
+def check_daily_path() -> bool:
+    """Imports the DAILY_PATH modules together in a fresh interpreter and returns whether scikit-learn stayed out of it"""
+
+    result = subprocess.run(
+        [sys.executable, "-c", f"import sys, {', '.join(DAILY_PATH)}; print('sklearn' in sys.modules)"],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not import the daily path: {result.stderr.strip().splitlines()[-1]}")
+
+    passed = result.stdout.strip() == "False"
+    print(f"{'OK  ' if passed else 'FAIL'} daily path imports {'no sklearn' if passed else 'sklearn'}")
+    return passed
+
+
+def main() -> None:
+    """Reports every module given (all of them by default) and exits with status 1 if any fails"""
+
+    parser = argparse.ArgumentParser(description="Import time report for the src modules")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="maximum import time of each module in seconds")
+    args = parser.parse_args()
+
+    results = [report(module, args.budget) for module in args.modules] + [check_daily_path()]
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,48 @@
 import pandas as pd
+import numpy as np
+import scipy.sparse as sp
 import barri_manager as barri_manager
 import networkx as nx
 import math
 import os
+import time
+import hashlib
+import itertools
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from collections.abc import Generator
 
-distance_graph = barri_manager.create_graph(draw=False)
-barri_list = list(distance_graph.nodes)
+# built on first use, see get_graph
+_distance_graph: nx.Graph | None = None
+_barri_list: list[str] | None = None
+
+# columns of the origin-destination data
+OD_COLUMNS = ["barrio_origen_name", "barrio_destino_name", "viajes", "day"]
+
+INTENSITIES_PATH = "data/intensities.csv"
+
+
+def get_graph() -> nx.Graph:
+    """Returns the barri graph, loading it the first time it is needed"""
+
+    global _distance_graph, _barri_list
+    if _distance_graph is None:
+        _distance_graph = barri_manager.load_graph()
+        _barri_list = list(_distance_graph.nodes)
+    return _distance_graph
+
+
+def get_barri_list() -> list[str]:
+    """Returns the barris in graph order, which is the order used by every matrix in this module"""
+
+    get_graph()
+    return _barri_list
 
 
 def trajectory_length(t: list[str]) -> float:
     """Calculates the length of a given trajectory. A trajectory is an ordered list of visited nodes"""
 
+    distance_graph = get_graph()
     sum = 0
     for i in range(len(t) - 1):
         sum += distance_graph[t[i]][t[i + 1]].get("weight")
@@ -40,82 +71,342 @@ def probability_distribution(
     return p_dist
 
 
-def create_trajectories() -> dict[str, tuple[list[list[str]], list[float]]]:
-    """Returns a dict that stores all trajectories from A to B
-    and their probability distribution for all A B in Vertices s.t. A != B"""
+def path_probabilities(
+    lengths: np.ndarray, pair_offsets: np.ndarray, alpha: int | float | np.ndarray
+) -> np.ndarray:
+    """Vectorized probability_distribution for every pair at once. lengths holds the length of every trajectory,
+    grouped by pair as described by pair_offsets. If alpha is an array of alphas, returns one row of probabilities per alpha"""
+
+    alphas = np.atleast_1d(np.asarray(alpha, dtype=np.float64))
+    sizes = np.diff(pair_offsets)
+    sizes = sizes[sizes > 0]
+    starts = pair_offsets[:-1][np.diff(pair_offsets) > 0]
+
+    # length of each trajectory relative to the shortest one of its pair
+    min_length = np.repeat(np.minimum.reduceat(lengths, starts), sizes)
+    ratio = lengths / min_length
+
+    # exp(-alpha * ratio) normalized per pair; shifting by 1 does not change the result and avoids underflow
+    weights = np.exp(-alphas[:, None] * (ratio[None, :] - 1))
+    totals = np.repeat(np.add.reduceat(weights, starts, axis=1), sizes, axis=1)
+    p_dist = weights / totals
+
+    return p_dist if np.ndim(alpha) else p_dist[0]
+
+
+class TrajectoryCache:
+    """Array-backed store of the trajectories between every ordered pair of barris and their probability distribution.
+    Barris are interned as small ints, trajectories are stored as one flat array of nodes plus offsets.
+    Only the paths and their lengths are stored, probabilities are computed for the cache's alpha"""
+
+    barris: np.ndarray  # barri names, the position of each name is the index used in nodes
+    nodes: np.ndarray  # barri index of every visited node, all trajectories one after the other
+    path_offsets: np.ndarray  # trajectory k is nodes[path_offsets[k] : path_offsets[k + 1]]
+    pair_offsets: np.ndarray  # pair a*n+b owns trajectories pair_offsets[a*n+b] : pair_offsets[a*n+b+1]
+    lengths: np.ndarray  # length of every trajectory
+    paths_fingerprint: str  # hash of the graph and number of paths the trajectories were computed with
+    alpha: float  # parameter of the probability distribution
+    p_dist: np.ndarray  # probability of every trajectory
+    fingerprint: str  # hash of paths_fingerprint and alpha
+
+    def __init__(
+        self,
+        barris: np.ndarray,
+        nodes: np.ndarray,
+        path_offsets: np.ndarray,
+        pair_offsets: np.ndarray,
+        lengths: np.ndarray,
+        paths_fingerprint: str,
+        alpha: int | float,
+    ):
+        self.barris = barris
+        self.nodes = nodes
+        self.path_offsets = path_offsets
+        self.pair_offsets = pair_offsets
+        self.lengths = lengths
+        self.paths_fingerprint = paths_fingerprint
+        self.alpha = alpha
+        self.p_dist = path_probabilities(lengths, pair_offsets, alpha).astype(np.float32)
+        self.fingerprint = trajectory_fingerprint(paths_fingerprint, alpha)
+        self.barri_to_index = {barri: i for i, barri in enumerate(barris)}
+
+    @classmethod
+    def from_dict(
+        cls,
+        pre_trajectories: dict[str, list[list[str]]],
+        barris: list[str],
+        paths_fingerprint: str,
+        alpha: int | float,
+    ) -> "TrajectoryCache":
+        """Builds the cache from a dict with keys "A->B" and the trajectories from A to B as values"""
+
+        n = len(barris)
+        barri_to_index = {barri: i for i, barri in enumerate(barris)}
+        nodes: list[int] = []
+        path_offsets: list[int] = [0]
+        pair_offsets: list[int] = [0]
+        lengths: list[float] = []
+        for a in range(n):
+            for b in range(n):
+                if a != b:
+                    for t in pre_trajectories[f"{barris[a]}->{barris[b]}"]:
+                        nodes.extend(barri_to_index[barri] for barri in t)
+                        path_offsets.append(len(nodes))
+                        lengths.append(trajectory_length(t))
+                pair_offsets.append(len(lengths))
+
+        return cls(
+            np.array(barris),
+            np.array(nodes, dtype=np.int16),
+            np.array(path_offsets, dtype=np.int32),
+            np.array(pair_offsets, dtype=np.int32),
+            np.array(lengths, dtype=np.float64),
+            paths_fingerprint,
+            alpha,
+        )
+
+    @classmethod
+    def load(cls, path: str, alpha: int | float) -> "TrajectoryCache":
+        """Loads trajectories stored with save and computes their probabilities for alpha"""
+
+        with np.load(path) as data:
+            return cls(
+                data["barris"],
+                data["nodes"],
+                data["path_offsets"],
+                data["pair_offsets"],
+                data["lengths"],
+                str(data["paths_fingerprint"]),
+                alpha,
+            )
+
+    def save(self, path: str) -> None:
+        """Stores the trajectories and their lengths as an uncompressed .npz file, which loads without any parsing"""
+
+        np.savez(
+            path,
+            barris=self.barris,
+            nodes=self.nodes,
+            path_offsets=self.path_offsets,
+            pair_offsets=self.pair_offsets,
+            lengths=self.lengths,
+            paths_fingerprint=np.array(self.paths_fingerprint),
+        )
+
+    def with_alpha(self, alpha: int | float) -> "TrajectoryCache":
+        """Returns a cache that shares these trajectories, with probabilities for another alpha"""
+
+        return TrajectoryCache(
+            self.barris,
+            self.nodes,
+            self.path_offsets,
+            self.pair_offsets,
+            self.lengths,
+            self.paths_fingerprint,
+            alpha,
+        )
+
+    def probabilities(self, alphas: np.ndarray) -> np.ndarray:
+        """Returns the probability of every trajectory for each alpha, shape (len(alphas), trajectories). Useful for alpha sweeps"""
+
+        return path_probabilities(self.lengths, self.pair_offsets, np.asarray(alphas))
+
+    def __len__(self) -> int:
+        n = len(self.barris)
+        return n * n - n
+
+    def __getitem__(self, key: str) -> tuple[list[list[str]], list[float]]:
+        """Returns the trajectories and probability distribution for a key "A->B", like the old dict"""
+
+        A, B = key.split("->")
+        pair = self.barri_to_index[A] * len(self.barris) + self.barri_to_index[B]
+        trajectories: list[list[str]] = []
+        for k in range(self.pair_offsets[pair], self.pair_offsets[pair + 1]):
+            t = self.nodes[self.path_offsets[k] : self.path_offsets[k + 1]]
+            trajectories.append([str(self.barris[i]) for i in t])
+        p_dist = self.p_dist[self.pair_offsets[pair] : self.pair_offsets[pair + 1]]
+        return trajectories, [float(p) for p in p_dist]
+
+
+def paths_fingerprint(graph: nx.Graph, beta: int) -> str:
+    """Returns a hash of the graph (nodes in order, edges and weights) and the number of paths per pair"""
+
+    h = hashlib.sha256()
+    h.update(repr(beta).encode())
+    for node in graph.nodes:
+        h.update(repr(node).encode())
+    for u, v, weight in sorted(graph.edges(data="weight")):
+        h.update(repr((u, v, round(weight, 6))).encode())
+    return h.hexdigest()[:16]
+
+
+def trajectory_fingerprint(paths_fingerprint: str, alpha: int | float) -> str:
+    """Returns a hash that identifies a set of trajectories together with the alpha of their probabilities"""
+
+    return hashlib.sha256(repr((paths_fingerprint, float(alpha))).encode()).hexdigest()[:16]
+
+
+_worker_graph: nx.Graph = None  # graph used by the path search processes
+
+
+def _init_path_worker(graph: nx.Graph) -> None:
+    """Stores the graph once per worker process instead of sending it with every task"""
+
+    global _worker_graph
+    _worker_graph = graph
+
 
-    # Parametres for probability distribution
-    alpha = 5
-    beta = 20  # Number of paths we consider that go from A to B
+def _paths_from_source(A: str, targets: list[str], beta: int) -> list[list[list[str]]]:
+    """Returns the beta shortest paths from A to every barri in targets, in the same order as targets"""
 
+    return [
+        list(
+            itertools.islice(
+                nx.shortest_simple_paths(_worker_graph, A, B, weight="weight"), beta
+            )
+        )
+        for B in targets
+    ]
+
+
+def create_trajectories(
+    alpha: int | float = 5, beta: int = 20, workers: int | None = None
+) -> TrajectoryCache:
+    """Returns a cache that stores all trajectories from A to B
+    and their probability distribution for all A B in Vertices s.t. A != B.
+    alpha is the parameter of the probability distribution and beta the number of paths we consider that go from A to B.
+    Paths are searched in a pool of worker processes (one task per source barri)"""
+
+    distance_graph = get_graph()
+    barri_list = get_barri_list()
     n = len(barri_list)
-    pre_trajectories: dict[str, tuple[list[list[str]], list[float]]] = {}
+    fingerprint = paths_fingerprint(distance_graph, beta)
+    cache_path = f"data/trajectories_{fingerprint}.npz"
 
     if os.path.exists(
-        "data/trajectories.csv"
-    ):  # If we have already computed trajectories and prob distr we dont recalculate them
+        cache_path
+    ):  # If we have already computed trajectories for this graph and beta we dont recalculate them, only their probabilities
         print("Fetching trajectories and probability distributions")
-        df = pd.read_csv("data/trajectories.csv")
-        for _, row in df.iterrows():
-            key = row["key"]
-            trajectories = [x.split("->") for x in row["trajectories"].split("|")]
-            p_dist = [float(p) for p in row["p_dist"].split("|")]
-            pre_trajectories[key] = (trajectories, p_dist)  # Rebuild dictionary
-
-        return pre_trajectories
+        return TrajectoryCache.load(cache_path, alpha)
 
     print("Creating trajectories and probability distributions")
+
+    # the graph is undirected, so we only search paths from a to b > a and reverse them for b to a
+    paths_from: dict[int, list[list[list[str]]]] = {}
+    total = (n * n - n) // 2
     c = 0
-    for a in range(n):  # Iterate over all pairs of barris
-        for b in range(n):
-            if a == b:
-                continue
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_path_worker, initargs=(distance_graph,)
+    ) as executor:
+        futures = {
+            executor.submit(_paths_from_source, barri_list[a], barri_list[a + 1 :], beta): a
+            for a in range(n - 1)
+        }
+        for future in as_completed(futures):
+            a = futures[future]
+            paths_from[a] = future.result()
+            c += n - 1 - a
+            print("\r" + str(math.floor(10000 * c / total) / 100) + "%", end="")
+
+    # assemble in a fixed order so the output does not depend on which worker finished first
+    pre_trajectories: dict[str, list[list[str]]] = {}
+    for a in range(n - 1):
+        for b in range(a + 1, n):
             A, B = barri_list[a], barri_list[b]
-            omega = nx.shortest_simple_paths(
-                distance_graph, A, B, weight="weight"
-            )  # Get all paths from A to B
-            path_count = 0
-            trajectories: list[list[str]] = []  # List of all paths that go from A to B
-            for path in omega:
-                trajectories.append(path)
-                path_count += 1
-                if path_count == beta:
-                    break
-            p_dist = probability_distribution(trajectories, alpha)
-            pre_trajectories[f"{A}->{B}"] = (trajectories, p_dist)
-            c += 1
-            print("\r" + str(math.floor(10000 * c / (n * n - n)) / 100) + "%", end="")
+            trajectories = paths_from[a][b - a - 1]  # List of all paths that go from A to B
+            pre_trajectories[f"{A}->{B}"] = trajectories
+            pre_trajectories[f"{B}->{A}"] = [t[::-1] for t in trajectories]
 
     print("")
     print("Saving trajectories and probability distributions")
-    pd.DataFrame(  # Store trajectories and prob distr in .csv file
-        {
-            "key": pre_trajectories.keys(),
-            "trajectories": [
-                "|".join(["->".join(t) for t in traj])
-                for traj, _ in pre_trajectories.values()
-            ],
-            "p_dist": [
-                "|".join([str(p) for p in p_distr])
-                for _, p_distr in pre_trajectories.values()
-            ],
-        }
-    ).to_csv("data/trajectories.csv")
+    cache = TrajectoryCache.from_dict(pre_trajectories, barri_list, fingerprint, alpha)
+    os.makedirs("data", exist_ok=True)
+    cache.save(cache_path)
+
+    return cache
+
 
-    return pre_trajectories
+def build_incidence_matrix(pre_trajectories: TrajectoryCache) -> sp.csr_matrix:
+    """Returns a sparse matrix of shape (n*n, n*n) that maps every ordered pair of barris (row a*n+b)
+    to the directed edges (column i*n+j) its trajectories go through, weighted by the probability of each trajectory"""
+
+    barri_list = get_barri_list()
+    n = len(barri_list)
+    barri_to_index: dict[str, int] = {barri_list[i]: i for i in range(n)}
+
+    # map the cache's barri indices to positions in barri_list
+    to_global = np.array([barri_to_index[barri] for barri in pre_trajectories.barris])
+    nodes = to_global[pre_trajectories.nodes]
+    path_lengths = np.diff(pre_trajectories.path_offsets)
+    pair_sizes = np.diff(pre_trajectories.pair_offsets)
+    n_cache = len(pre_trajectories.barris)
+    pairs = np.arange(n_cache * n_cache)
+    pair_index = to_global[pairs // n_cache] * n + to_global[pairs % n_cache]
+
+    # every node position except the last of each trajectory starts a hop
+    path_of_node = np.repeat(np.arange(len(path_lengths)), path_lengths)
+    is_hop = np.ones(len(nodes), dtype=bool)
+    is_hop[pre_trajectories.path_offsets[1:] - 1] = False
+    hops = np.flatnonzero(is_hop)
+    hop_paths = path_of_node[hops]
+
+    rows = np.repeat(pair_index, pair_sizes)[hop_paths]
+    cols = nodes[hops] * n + nodes[hops + 1]
+    data = pre_trajectories.p_dist[hop_paths].astype(np.float64)
+
+    # repeated (pair, edge) entries are summed when converting to csr
+    return sp.coo_matrix((data, (rows, cols)), shape=(n * n, n * n)).tocsr()
 
 
 def load_phis(
     data_df: pd.DataFrame,
-    pre_trajectories: dict[str, tuple[list[list[str]], list[float]]],
+    pre_trajectories: TrajectoryCache,
     verbose: int = 1,
+    incidence: sp.csr_matrix = None,
 ) -> pd.DataFrame:
-    """Returns a DataFrame with columns: day (same for every row) barri and intensity"""
+    """Returns a DataFrame with columns: day (same for every row) barri and intensity.
+    The incidence matrix can be passed to avoid rebuilding it for every day"""
+
+    if incidence is None:
+        incidence = build_incidence_matrix(pre_trajectories)
+
+    # Day we are computing
+    day = data_df["day"].iloc[0]
+
+    barri_list = get_barri_list()
+    n = len(barri_list)
+    barri_to_index: dict[str, int] = {barri_list[i]: i for i in range(n)}
+
+    # flattened matrix N where in cell a*n+b we store number of journeys from barri a to b
+    origins = data_df["barrio_origen_name"].map(barri_to_index).to_numpy()
+    destinations = data_df["barrio_destino_name"].map(barri_to_index).to_numpy()
+    N = np.zeros(n * n)
+    N[origins * n + destinations] = data_df["viajes"].to_numpy()
+    N[:: n + 1] = 0  # journeys inside a barri do not go through any edge
+
+    # gamma[i][j]: journeys that go through barris i and j (i, j adjacent) times the probability of taking that path
+    gamma = (incidence.T @ N).reshape(n, n)
+
+    # Phi or Barri intensity will be the flow out and in of a barri
+    phi = gamma.sum(axis=1) + gamma.sum(axis=0)
+    if verbose == 1:
+        print("Computed intensities for day " + str(day))
+
+    return pd.DataFrame({"day": [day] * n, "barri": barri_list, "intensity": phi})
+
+
+def load_phis_loop(
+    data_df: pd.DataFrame,
+    pre_trajectories: TrajectoryCache,
+    verbose: int = 1,
+) -> pd.DataFrame:
+    """Reference implementation of load_phis that walks every trajectory in Python. Kept to validate and benchmark the sparse version"""
 
     # Day we are computing
     day = data_df["day"].iloc[0]
     df = pd.DataFrame({"day": [], "barri": [], "intensity": []})
 
+    barri_list = get_barri_list()
     n = len(barri_list)
     barri_to_index: dict[str, int] = {barri_list[i]: i for i in range(n)}
 
@@ -164,41 +455,330 @@ def load_phis(
     return df
 
 
+def intensity_operator(incidence: sp.csr_matrix) -> np.ndarray:
+    """Returns the dense (n*n, n) matrix that maps the flattened OD vector of a day
+    straight to the intensity of every barri (incidence matrix followed by the in/out flow reduction)"""
+
+    barri_list = get_barri_list()
+    n = len(barri_list)
+    edges = np.arange(n * n)
+
+    # edge i*n+j adds its flow to both barri i (flow out) and barri j (flow in)
+    reduction = sp.coo_matrix(
+        (
+            np.ones(2 * n * n),
+            (np.concatenate([edges, edges]), np.concatenate([edges // n, edges % n])),
+        ),
+        shape=(n * n, n),
+    ).tocsr()
+    return (incidence @ reduction).toarray()
+
+
+def load_phis_batched(
+    data_df: pd.DataFrame,
+    operator: np.ndarray,
+    chunk_size: int = 366,
+    verbose: int = 1,
+) -> pd.DataFrame:
+    """Returns a DataFrame with columns: day, barri and intensity for every day in data_df.
+    Days are pivoted into a (days, pairs) matrix and multiplied by the intensity operator,
+    chunk_size days at a time so memory stays around chunk_size * n * n floats"""
+
+    barri_list = get_barri_list()
+    n = len(barri_list)
+    barri_to_index: dict[str, int] = {barri_list[i]: i for i in range(n)}
+
+    days, day_index = np.unique(data_df["day"].to_numpy(), return_inverse=True)
+    pairs = (
+        data_df["barrio_origen_name"].map(barri_to_index).to_numpy() * n
+        + data_df["barrio_destino_name"].map(barri_to_index).to_numpy()
+    )
+    viajes = data_df["viajes"].to_numpy()
+
+    # sort rows by day so every chunk is a contiguous slice (stable to keep the last value for repeated pairs)
+    order = np.argsort(day_index, kind="stable")
+    day_index, pairs, viajes = day_index[order], pairs[order], viajes[order]
+
+    phi_chunks: list[np.ndarray] = []
+    for start in range(0, len(days), chunk_size):
+        end = min(start + chunk_size, len(days))
+        lo, hi = np.searchsorted(day_index, [start, end])
+        if verbose == 1:
+            print(f"Processing days {days[start]} to {days[end - 1]}")
+
+        N = np.zeros((end - start, n * n))
+        N[day_index[lo:hi] - start, pairs[lo:hi]] = viajes[lo:hi]
+        N[:, :: n + 1] = 0  # journeys inside a barri do not go through any edge
+        phi_chunks.append(N @ operator)
+
+    phi = np.vstack(phi_chunks) if phi_chunks else np.zeros((0, n))
+    return pd.DataFrame(
+        {
+            "day": np.repeat(days, n),
+            "barri": np.tile(barri_list, len(days)),
+            "intensity": phi.ravel(),
+        }
+    )
+
+
+def benchmark_load_phis(
+    data_df: pd.DataFrame,
+    pre_trajectories: TrajectoryCache,
+    repeat: int = 3,
+) -> dict[str, float]:
+    """Times the sparse load_phis against the Python loop for a single day and checks that both agree.
+    Returns the best time of each version in seconds and the maximum absolute difference"""
+
+    start = time.perf_counter()
+    incidence = build_incidence_matrix(pre_trajectories)
+    build_time = time.perf_counter() - start
+
+    loop_times: list[float] = []
+    sparse_times: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        loop_df = load_phis_loop(data_df, pre_trajectories, verbose=0)
+        loop_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        sparse_df = load_phis(data_df, pre_trajectories, verbose=0, incidence=incidence)
+        sparse_times.append(time.perf_counter() - start)
+
+    max_diff = float(
+        np.max(np.abs(loop_df["intensity"].to_numpy() - sparse_df["intensity"].to_numpy()))
+    )
+    results = {
+        "incidence_build": build_time,
+        "loop": min(loop_times),
+        "sparse": min(sparse_times),
+        "max_abs_diff": max_diff,
+    }
+    print(
+        f"Incidence matrix built in {build_time:.3f}s. "
+        f"Loop: {results['loop']:.3f}s, sparse: {results['sparse']:.5f}s "
+        f"({results['loop'] / results['sparse']:.0f}x), max abs diff: {max_diff:.3e}"
+    )
+    return results
+
+
+def intensity_cache_info_path(path: str) -> str:
+    """Returns the path of the file that describes the intensity cache stored in path"""
+
+    return os.path.splitext(path)[0] + ".json"
+
+
+def load_intensity_cache(
+    path: str, fingerprint: str
+) -> tuple[pd.DataFrame, set[str]] | None:
+    """Returns the cached intensities and the days they cover if they were computed
+    with trajectories that have the given fingerprint, None otherwise"""
+
+    info_path = intensity_cache_info_path(path)
+    if not (os.path.exists(path) and os.path.exists(info_path)):
+        return None
+
+    with open(info_path) as f:
+        info = json.load(f)
+    if info.get("fingerprint") != fingerprint:
+        print("Cached intensities were computed with other trajectories, ignoring them")
+        return None
+
+    return pd.read_csv(path, dtype={"day": str}), set(info["days"])
+
+
+def save_intensity_cache(df: pd.DataFrame, path: str, fingerprint: str) -> None:
+    """Stores the intensities (days as YYYY-MM-DD strings) with the days they cover and the trajectories fingerprint"""
+
+    df.to_csv(path, index=None)
+    with open(intensity_cache_info_path(path), "w") as f:
+        json.dump(
+            {"fingerprint": fingerprint, "days": sorted(df["day"].unique().tolist())},
+            f,
+        )
+
+
 def process_df(
     df: pd.DataFrame,
-    pre_trajectories: dict[str, tuple[list[list[str]], list[float]]] = None,
+    pre_trajectories: TrajectoryCache = None,
     download: bool = False,
     verbose: int = 1,
+    batched: bool = True,
+    chunk_size: int = 366,
 ) -> pd.DataFrame:
-    """This function takes in a DataFrame and divides it by days, later extracting the phis for every day. The trajectories can also be passed, as this helps a lot with efficiency"""
+    """This function takes in a DataFrame and divides it by days, later extracting the phis for every day. The trajectories can also be passed, as this helps a lot with efficiency.
+    In batched mode all days are computed with a few matrix products of at most chunk_size days each.
+    Days already in the intensity cache (computed with the same trajectories) are not recomputed, and the new days are merged into the cache"""
 
     if pre_trajectories is None:
         pre_trajectories = create_trajectories()
 
-    if os.path.exists("data/intensities.csv") and not download:
+    cache = load_intensity_cache(INTENSITIES_PATH, pre_trajectories.fingerprint)
+
+    legacy_csv = os.path.exists(INTENSITIES_PATH) and not os.path.exists(
+        intensity_cache_info_path(INTENSITIES_PATH)
+    )
+    if legacy_csv and not download:
+        # intensities without cache information (e.g. generated by example_data) are used as they are,
+        # a cache computed with other trajectories is recomputed
         print("Fetching intensities.csv")
-        df = pd.read_csv("data/intensities.csv")
+        df = pd.read_csv(INTENSITIES_PATH)
         df["day"] = pd.to_datetime(df["day"])
         return df
 
-    df_results_list: list[pd.DataFrame] = (
-        []
-    )  # We store dataframes about intensity for each barri for each day
+    cached_df = None
+    if cache is not None:
+        cached_df, covered_days = cache
+        df = df[~df["day"].isin(covered_days)]
+        print(
+            f"Fetching {len(covered_days)} cached days, computing {df['day'].nunique()} new days"
+        )
 
-    samples = df.groupby("day")
-    for day_group in samples:
-        (day, data_df) = day_group
-        if verbose == 1:
-            if day[-2:] == "01":
-                # new month
-                print("Processing month " + day[:-3])
-        elif verbose == 2:
-            print("Processing day " + day)
+    if df.empty:
+        df = cached_df
+    else:
+        # built once and shared by every day
+        incidence = build_incidence_matrix(pre_trajectories)
+
+        if batched:
+            df = load_phis_batched(df, intensity_operator(incidence), chunk_size, verbose)
+        else:
+            df_results_list: list[pd.DataFrame] = (
+                []
+            )  # We store dataframes about intensity for each barri for each day
+
+            samples = df.groupby("day")
+            for day_group in samples:
+                (day, data_df) = day_group
+                if verbose == 1:
+                    if day[-2:] == "01":
+                        # new month
+                        print("Processing month " + day[:-3])
+                elif verbose == 2:
+                    print("Processing day " + day)
+
+                df_results_list.append(
+                    load_phis(data_df, pre_trajectories, verbose == 2, incidence)
+                )
 
-        df_results_list.append(load_phis(data_df, pre_trajectories, verbose == 2))
+            df = pd.concat(df_results_list, ignore_index=True)
+
+        if cached_df is not None:
+            # stable sort keeps the barri order inside every day
+            df = pd.concat([cached_df, df], ignore_index=True)
+            df = df.sort_values("day", kind="stable", ignore_index=True)
+        # new days are written back, otherwise every later run would compute them again
+        save_intensity_cache(df, INTENSITIES_PATH, pre_trajectories.fingerprint)
 
-    df = pd.concat(df_results_list, ignore_index=True)
     df["day"] = pd.to_datetime(df["day"])
-    if download:
-        df.to_csv("data/intensities.csv", index=None)
     return df
+
+
+def read_od_days(
+    paths: str | list[str], chunksize: int = 1_000_000
+) -> Generator[tuple[str, pd.DataFrame], None, None]:
+    """Reads origin-destination csv files in chunks and yields (day, rows of that day) as soon as each day is complete.
+    Rows of the same day must be contiguous across the files (the exports are sorted by day)"""
+
+    if isinstance(paths, str):
+        paths = [paths]
+
+    completed: set[str] = set()
+    current_day: str | None = None
+    buffer: list[pd.DataFrame] = []
+    for path in paths:
+        for chunk in pd.read_csv(path, usecols=OD_COLUMNS, chunksize=chunksize):
+            # groups keep the order in which days appear in the chunk
+            for day, day_df in chunk.groupby("day", sort=False):
+                if day == current_day:
+                    buffer.append(day_df)
+                    continue
+                if day in completed:
+                    raise ValueError(f"Rows for day {day} are not contiguous in {path}")
+                if current_day is not None:
+                    yield current_day, pd.concat(buffer, ignore_index=True)
+                    completed.add(current_day)
+                current_day, buffer = day, [day_df]
+
+    if current_day is not None:
+        yield current_day, pd.concat(buffer, ignore_index=True)
+
+
+def stream_phis(
+    paths: str | list[str],
+    pre_trajectories: TrajectoryCache = None,
+    chunksize: int = 1_000_000,
+    skip_until: str | None = None,
+    verbose: int = 1,
+) -> Generator[pd.DataFrame, None, None]:
+    """Yields the intensity DataFrame (day, barri, intensity) of every day in the origin-destination files
+    without loading them whole. Days up to skip_until (inclusive) are skipped"""
+
+    if pre_trajectories is None:
+        pre_trajectories = create_trajectories()
+    incidence = build_incidence_matrix(pre_trajectories)
+
+    for day, data_df in read_od_days(paths, chunksize):
+        if skip_until is not None and day <= skip_until:
+            continue
+        if verbose == 1 and day[-2:] == "01":
+            # new month
+            print("Processing month " + day[:-3])
+        elif verbose == 2:
+            print("Processing day " + day)
+        yield load_phis(data_df, pre_trajectories, 0, incidence)
+
+
+def last_completed_day(out_path: str) -> str | None:
+    """Returns the last day fully written to out_path. A partially written last day (crash during a write) is removed from the file"""
+
+    if not os.path.exists(out_path):
+        return None
+
+    df = pd.read_csv(out_path, dtype={"day": str})
+    if df.empty:
+        return None
+
+    last_day = df["day"].iloc[-1]
+    if (df["day"] == last_day).sum() < len(get_barri_list()):
+        df = df[df["day"] != last_day]
+        df.to_csv(out_path, index=None)
+        if df.empty:
+            return None
+        last_day = df["day"].iloc[-1]
+    return last_day
+
+
+def process_stream(
+    paths: str | list[str],
+    out_path: str = "data/intensities.csv",
+    pre_trajectories: TrajectoryCache = None,
+    chunksize: int = 1_000_000,
+    verbose: int = 1,
+) -> None:
+    """Computes the intensities of origin-destination files larger than memory, appending every day to out_path as soon as it is done.
+    If out_path already has results (e.g. after a crash), it resumes from the day after the last completed one"""
+
+    if pre_trajectories is None:
+        pre_trajectories = create_trajectories()
+
+    info_path = intensity_cache_info_path(out_path)
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            if json.load(f).get("fingerprint") != pre_trajectories.fingerprint:
+                print("Existing intensities were computed with other trajectories, starting over")
+                os.remove(out_path)
+                os.remove(info_path)
+
+    resume_from = last_completed_day(out_path)
+    if resume_from is not None:
+        print("Resuming after day " + resume_from)
+
+    write_header = not os.path.exists(out_path)
+    for day_df in stream_phis(paths, pre_trajectories, chunksize, resume_from, verbose):
+        day_df.to_csv(out_path, mode="a", header=write_header, index=None)
+        write_header = False
+
+    # record the covered days so process_df can reuse the results
+    save_intensity_cache(
+        pd.read_csv(out_path, dtype={"day": str}), out_path, pre_trajectories.fingerprint
+    )
@@ -1,20 +1,215 @@
+from __future__ import annotations
+
 import os
 import asyncio
 import datetime
+import hashlib
 import json
+import random
+import re
 import time
+from collections import Counter
 import pandas as pd
 from pydantic import BaseModel, Field
-from google import genai
-from google.genai import types
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-from playwright.async_api import async_playwright, BrowserContext, Error as PlaywrightError
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, TYPE_CHECKING
+
+# google-genai, playwright and bs4 are imported where they are used
+if TYPE_CHECKING:
+    from google import genai
+    from bs4 import Tag
+    from playwright.async_api import BrowserContext
 
 load_dotenv() 
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY") 
-client = genai.Client(api_key=GEMINI_API_KEY)
+_client: genai.Client | None = None
+
+LLM_MODEL = "gemini-2.5-flash"
+LLM_REQUESTS_PER_MINUTE = float(os.environ.get("GEMINI_RPM", 5))  # quota of the API key
+LLM_MAX_CONCURRENCY = 4  # requests in flight at once
+LLM_MAX_RETRIES = 4
+LLM_BACKOFF = 5  # seconds before the first retry, doubled after each one
+
+# text reduction: blocks are kept if they have a date up to WINDOW_MARGIN_DAYS outside the target interval
+WINDOW_MARGIN_DAYS = 3
+CONTEXT_LINES = 2  # lines kept before a date in lists without structure, usually the title of the entry
+CHARS_PER_TOKEN = 4  # rough estimate used to report the tokens saved
+
+# month names and abbreviations in Spanish, Catalan and English. Abbreviations that are ordinary words (mar, set, des)
+# are left out, and every name is only read next to a day number
+MONTHS = {
+    1: ["enero", "ene", "gener", "gen", "january", "jan"],
+    2: ["febrero", "feb", "febrer", "february"],
+    3: ["marzo", "març", "march"],
+    4: ["abril", "abr", "april", "apr"],
+    5: ["mayo", "may", "maig"],
+    6: ["junio", "jun", "juny", "june"],
+    7: ["julio", "jul", "juliol", "july"],
+    8: ["agosto", "ago", "agost", "august", "aug"],
+    9: ["septiembre", "setiembre", "sep", "sept", "setembre", "september"],
+    10: ["octubre", "oct", "october"],
+    11: ["noviembre", "nov", "novembre", "november"],
+    12: ["diciembre", "dic", "desembre", "december", "dec"],
+}
+MONTH_NUMBERS = {name: month for month, names in MONTHS.items() for name in names}
+_MONTH = "|".join(sorted(MONTH_NUMBERS, key=len, reverse=True))
+
+_ORDINAL = r"(?:st|nd|rd|th|º)?"
+# words between the two ends of a range: 10-12, del 10 al 12, 10 to 12
+_RANGE = r"\s*(?:-|–|—|al|a|to|until|hasta(?:\s+el)?|fins(?:\s+al)?)\s*"
+
+# 25 de septiembre de 2025, 25 d'octubre, 25 September 2025, 1st of May
+DAY_MONTH_RE = re.compile(rf"\b(\d{{1,2}}){_ORDINAL}\s*(?:de\s+|d['’]\s*|of\s+)?({_MONTH})\b\.?(?:,?\s*(?:de\s+|del\s+)?(\d{{4}}))?", re.IGNORECASE)
+# September 25, 2025, Oct 3
+MONTH_DAY_RE = re.compile(rf"\b({_MONTH})\.?\s+(\d{{1,2}}){_ORDINAL}\b(?:,?\s*(\d{{4}}))?", re.IGNORECASE)
+# 2025-09-25
+ISO_RE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+# 25/09/2025, 25-09-25, always day first and with a year, so scores (2-1) and times (21.30) are not dates
+NUMERIC_RE = re.compile(r"\b(\d{1,2})([/.-])(\d{1,2})\2(\d{4}|\d{2})\b")
+# del 10 al 30 de octubre de 2026, 14-16 oct
+DAY_RANGE_RE = re.compile(rf"\b(\d{{1,2}}){_ORDINAL}{_RANGE}(\d{{1,2}}){_ORDINAL}\s*(?:de\s+|d['’]\s*|of\s+)?({_MONTH})\b\.?(?:,?\s*(?:de\s+|del\s+)?(\d{{4}}))?", re.IGNORECASE)
+# text between two dates that makes them a range: October 14 - November 2, del 10 de octubre al 2 de noviembre
+RANGE_JOIN_RE = re.compile(_RANGE, re.IGNORECASE)
+
+# marks the start of every entry in the page text, replaced by a blank line. Not whitespace, so get_text doesn't strip it
+BLOCK_MARK = "\ue000"
+
+# extractions of unchanged pages are reused from this cache
+LLM_CACHE_PATH = "data/llm_cache.json"
+LLM_CACHE_TTL = datetime.timedelta(days=float(os.environ.get("LLM_CACHE_TTL_DAYS", 7)))
+
+
+def get_client() -> genai.Client:
+    """Returns the Gemini client, creating it the first time it is needed"""
+    from google import genai
+
+    global _client
+    if _client is None:
+        _client = genai.Client(api_key=GEMINI_API_KEY)
+    return _client
+
+class TokenBucket:
+    """Rate limiter for asyncio tasks: tokens are added at a constant rate up to capacity and every request takes one"""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Waits until a token is available and takes it"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ExtractionCache:
+    """Results of previous extractions, keyed by a hash of the page text and the instructions of the prompt. Every entry
+    stores the interval it was extracted for, and is reused by any later run whose interval falls inside it.
+    Entries older than ttl are evicted"""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: datetime.timedelta = LLM_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.entries: dict[str, dict] = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"--- Warning: LLM cache could not be read, starting empty. Error: {e} ---")
+        self.evict()
+
+    @staticmethod
+    def key(kind: str, text: str, more_info: str) -> str:
+        """Returns the hash of the extraction kind, model, URL instructions and page text"""
+        content = "\n".join([kind, LLM_MODEL, more_info, hashlib.sha256(text.encode()).hexdigest()])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def evict(self) -> None:
+        """Removes the entries older than the ttl"""
+        oldest = (datetime.datetime.now() - self.ttl).isoformat()
+        self.entries = {key: entry for key, entry in self.entries.items() if entry["created"] >= oldest}
+
+    def get(self, key: str, today: datetime.date, end_date: datetime.date) -> list[dict] | None:
+        """Returns the results of the entry that fall between today and end_date, None if there is no entry or it was
+        extracted for an interval that doesn't cover them"""
+        entry = self.entries.get(key)
+        # entries saved before the interval was stored don't have it
+        if entry is None or "start" not in entry:
+            return None
+        if entry["start"] > today.isoformat() or entry["end"] < end_date.isoformat():
+            return None
+        return in_window(entry["result"], today, end_date)
+
+    def set(self, key: str, result: list[dict], start: datetime.date, end: datetime.date) -> None:
+        self.entries[key] = {
+            "created": datetime.datetime.now().isoformat(),
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "result": result,
+        }
+
+    def save(self) -> None:
+        self.evict()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f)
+
+
+def in_window(results: list[dict], today: datetime.date, end_date: datetime.date) -> list[dict]:
+    """Returns the extracted events or holidays dated between today and end_date (inclusive)"""
+    kept = []
+    for result in results:
+        try:
+            date = datetime.date.fromisoformat(str(result.get("date", ""))[:10])
+        except ValueError:
+            continue
+        if today <= date <= end_date:
+            kept.append(result)
+    return kept
+
+async def generate_json(prompt: str, schema: type[BaseModel], limiter: TokenBucket, semaphore: asyncio.Semaphore, kind: str) -> dict | None:
+    """Asks Gemini for a JSON response following schema. Rate limited by limiter and semaphore, rate limit (429)
+    and server (5xx) errors are retried with exponential backoff. Returns None if the extraction fails"""
+    from google.genai import errors, types
+
+    config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=schema,
+    )
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        await limiter.acquire()
+        try:
+            async with semaphore:
+                response = await get_client().aio.models.generate_content(
+                    model=LLM_MODEL,
+                    contents=prompt,
+                    config=config
+                )
+            return json.loads(response.text)
+
+        except errors.APIError as e:
+            if (e.code == 429 or e.code >= 500) and attempt < LLM_MAX_RETRIES:
+                delay = LLM_BACKOFF * 2 ** attempt + random.uniform(0, 1)
+                print(f"--- LLM ({kind}) request failed with code {e.code}, retrying in {delay:.0f}s ---")
+                await asyncio.sleep(delay)
+                continue
+            print(f"--- Warning: LLM ({kind}) extraction failed. Error: {e} ---")
+            return None
+
+        except (json.JSONDecodeError, Exception) as e:
+            print(f"--- Warning: LLM ({kind}) extraction failed. Error: {e} ---")
+            return None
 
 EventType = [
     "Sporting Event",
@@ -68,41 +263,41 @@ class EventList(BaseModel):
         description="A list of all events found that occur on the target interval."
     )
 
-def extract_festius(text: str, today: datetime.date, end_date: datetime.date, more_info: str) -> list[dict]:
-    """Extracts festius that happen within the date interval from the text using Gemini."""
+async def extract_festius(text: str, today: datetime.date, end_date: datetime.date, more_info: str, limiter: TokenBucket, semaphore: asyncio.Semaphore, cache: ExtractionCache) -> list[dict]:
+    """Extracts festius that happen within the date interval from the text using Gemini, or from the cache if the same extraction was done before.
+    Gemini is asked for the whole interval kept by reduce_to_window, so the cached result also serves the next days."""
+    key = cache.key("festius", text, more_info)
+    if (cached := cache.get(key, today, end_date)) is not None:
+        print("Festius found in the LLM cache.")
+        return cached
+    extraction_end = end_date + datetime.timedelta(days=WINDOW_MARGIN_DAYS)
 
     prompt = f"""You are an expert holidays data extraction system. Your task is to analyze the provided web page text and identify all events that occur within a specified time interval.
-    **Target Interval:** You must extract ALL holidays that occur between the start date, **{today.strftime('%Y-%m-%d')}**, and the end date, **{end_date.strftime('%Y-%m-%d')}**, inclusive.
+    **Target Interval:** You must extract ALL holidays that occur between the start date, **{today.strftime('%Y-%m-%d')}**, and the end date, **{extraction_end.strftime('%Y-%m-%d')}**, inclusive.
         **Exclusions:** You must ignore any events that fall outside of this interval.
     **URL-SPECIFIC EXTRACTION INSTRUCTIONS:** {more_info}
     **WEB PAGE TEXT:**
     {text}"""
     
-    config = types.GenerateContentConfig(
-        response_mime_type="application/json",
-        response_schema=HolidayList,
-    )
-
-    try:
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config=config
-        )
-        data_dict = json.loads(response.text)
-        return data_dict.get('holidays', [])
-    
-    except (json.JSONDecodeError, Exception) as e:
-        print(f"--- Warning: LLM (Festius) extraction failed. Error: {e} ---")
+    data_dict = await generate_json(prompt, HolidayList, limiter, semaphore, "Festius")
+    if data_dict is None:
         return []
-
-def extract_events(text: str, today: datetime.date, end_date: datetime.date, more_info: str) -> list[dict]:
-    """Extracts events that happen within the date interval from the text using Gemini."""
+    cache.set(key, data_dict.get('holidays', []), today, extraction_end)
+    return in_window(data_dict.get('holidays', []), today, end_date)
+
+async def extract_events(text: str, today: datetime.date, end_date: datetime.date, more_info: str, limiter: TokenBucket, semaphore: asyncio.Semaphore, cache: ExtractionCache) -> list[dict]:
+    """Extracts events that happen within the date interval from the text using Gemini, or from the cache if the same extraction was done before.
+    Gemini is asked for the whole interval kept by reduce_to_window, so the cached result also serves the next days."""
+    key = cache.key("events", text, more_info)
+    if (cached := cache.get(key, today, end_date)) is not None:
+        print("Events found in the LLM cache.")
+        return cached
+    extraction_end = end_date + datetime.timedelta(days=WINDOW_MARGIN_DAYS)
 
     prompt = f"""You are an expert event data extraction system. Your task is to analyze the provided web page text and identify all events that occur within a specified time interval.
 
     Strictly adhere to the following rules:
-    1.  **Target Interval:** You must extract ALL events that occur between the start date, **{today.strftime('%Y-%m-%d')}**, and the end date, **{end_date.strftime('%Y-%m-%d')}**, inclusive.
+    1.  **Target Interval:** You must extract ALL events that occur between the start date, **{today.strftime('%Y-%m-%d')}**, and the end date, **{extraction_end.strftime('%Y-%m-%d')}**, inclusive.
         * **Inference:** You must use your natural language understanding to correctly parse dates, regardless of the text format (e.g., '25 de septiembre', 'tomorrow', 'next week').
         * **Exclusions:** You must ignore any events that fall outside of this interval.
     2.  **Event Date Field:** For the 'event_date' field in the JSON, you MUST convert the date you find to the standard **YYYY-MM-DD** format.
@@ -120,29 +315,18 @@ def extract_events(text: str, today: datetime.date, end_date: datetime.date, mor
     **WEB PAGE TEXT:**
     {text}"""
     
-    config = types.GenerateContentConfig(
-        response_mime_type="application/json",
-        response_schema=EventList,
-    )
-
-    try:
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config=config
-        )
-        data_dict = json.loads(response.text)
-        return data_dict.get('events', [])
-    
-    except (json.JSONDecodeError, Exception) as e:
-        print(f"--- Warning: LLM (Events) extraction failed. Error: {e} ---")
+    data_dict = await generate_json(prompt, EventList, limiter, semaphore, "Events")
+    if data_dict is None:
         return []
+    cache.set(key, data_dict.get('events', []), today, extraction_end)
+    return in_window(data_dict.get('events', []), today, end_date)
 
 async def scrape_web_with_context(context: BrowserContext, url: str) -> str:
     """
     Uses an existing browser context to scrape a single URL and clean the HTML.
     Includes special handling for highly dynamic sites like Primavera Sound.
     """
+    from playwright.async_api import Error as PlaywrightError
     
     page = await context.new_page()
     print(f"Navigating to {url}...")
@@ -172,12 +356,17 @@ async def scrape_web_with_context(context: BrowserContext, url: str) -> str:
         await page.close()
 
     print(f"Cleaning HTML content for {url}...")
-    
+    return html_to_text(raw_html)
+
+def html_to_text(raw_html: str) -> str:
+    """Returns the text of the page body, one line per text element and a blank line before every entry (see mark_entries)"""
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(raw_html, 'html.parser')
     body_tag = soup.find('body')
          
     if not body_tag:
-        return soup.get_text(separator=' ', strip=True) 
+        return soup.get_text(separator='\n', strip=True) 
 
     unwanted_tags = [   # Remove everything with these tags for more efficient extraction
         "script", 
@@ -192,13 +381,169 @@ async def scrape_web_with_context(context: BrowserContext, url: str) -> str:
     for element in body_tag.find_all(unwanted_tags):
         element.decompose()
         
-    clean_content = body_tag.get_text(separator=' ', strip=True)
-    return clean_content
+    mark_entries(body_tag)
+    clean_content = body_tag.get_text(separator='\n', strip=True) # One line per text element
+    clean_content = re.sub(rf"\n?{BLOCK_MARK}\n?", "\n\n", clean_content) # Blank line before every entry, the blocks of reduce_to_window
+    return re.sub(r"\n{3,}", "\n\n", clean_content).strip()
+
+def mark_entries(body_tag: Tag) -> None:
+    """Inserts BLOCK_MARK before every list item and table row, the entries of calendars and fixture lists"""
+    for entry in body_tag.select("ul > li, ol > li, tr"):
+        entry.insert_before(BLOCK_MARK)
+
+def make_date(year: int | None, month: int, day: int, today: datetime.date) -> datetime.date | None:
+    """Returns the date, taking the year closest to today when it is not given. None if it is not a valid date"""
+    try:
+        if year is not None:
+            return datetime.date(year + 2000 if year < 100 else year, month, day)
+        candidates = [datetime.date(today.year + offset, month, day) for offset in (-1, 0, 1)]
+    except ValueError:
+        return None
+    return min(candidates, key=lambda date: abs(date - today))
+
+
+def make_interval(start: tuple, end: tuple, today: datetime.date) -> tuple[datetime.date, datetime.date] | None:
+    """Returns the interval between two (year, month, day) dates, a missing year is taken from the other end. None if it is not valid"""
+    start_year, start_month, start_day = start
+    end_year, end_month, end_day = end
+    if start_year is not None:
+        first = make_date(start_year, start_month, start_day, today)
+        if first is None:
+            return None
+        last = make_date(end_year if end_year is not None else first.year, end_month, end_day, today)
+        if last is not None and end_year is None and last < first:
+            # 28 de diciembre de 2026 al 3 de enero
+            last = make_date(first.year + 1, end_month, end_day, today)
+    else:
+        last = make_date(end_year, end_month, end_day, today)
+        if last is None:
+            return None
+        first = make_date(last.year, start_month, start_day, today)
+        if first is not None and first > last:
+            # December 28 - January 3, 2027
+            first = make_date(last.year - 1, start_month, start_day, today)
+
+    if first is None or last is None or first > last:
+        return None
+    return first, last
+
+
+def find_intervals(line: str, today: datetime.date) -> list[tuple[datetime.date, datetime.date]]:
+    """Returns the dates and date ranges written in the line, in Spanish, Catalan or English formats, as (first, last) intervals.
+    A single date is an interval of one day"""
+    intervals = []
+    for first_day, last_day, month, year in DAY_RANGE_RE.findall(line):
+        year, month = int(year) if year else None, MONTH_NUMBERS[month.lower()]
+        intervals.append(make_interval((year, month, int(first_day)), (year, month, int(last_day)), today))
+    # the last day of those ranges is not read again as a single date
+    line = DAY_RANGE_RE.sub(lambda match: " " * len(match.group()), line)
+
+    # single dates as (start, end, (year, month, day)), in the order they are written
+    dates = []
+    for match in DAY_MONTH_RE.finditer(line):
+        day, month, year = match.groups()
+        dates.append((*match.span(), (int(year) if year else None, MONTH_NUMBERS[month.lower()], int(day))))
+    for match in MONTH_DAY_RE.finditer(line):
+        month, day, year = match.groups()
+        dates.append((*match.span(), (int(year) if year else None, MONTH_NUMBERS[month.lower()], int(day))))
+    for match in ISO_RE.finditer(line):
+        year, month, day = match.groups()
+        dates.append((*match.span(), (int(year), int(month), int(day))))
+    for match in NUMERIC_RE.finditer(ISO_RE.sub(lambda match: " " * len(match.group()), line)):
+        day, _, month, year = match.groups()
+        dates.append((*match.span(), (int(year), int(month), int(day))))
+    dates.sort()
+
+    i = 0
+    while i < len(dates):
+        if i + 1 < len(dates) and RANGE_JOIN_RE.fullmatch(line[dates[i][1]:dates[i + 1][0]]):
+            # October 14 - November 2, 2026
+            intervals.append(make_interval(dates[i][2], dates[i + 1][2], today))
+            i += 2
+        else:
+            intervals.append(make_interval(dates[i][2], dates[i][2], today))
+            i += 1
+    return [interval for interval in intervals if interval is not None]
+
+
+def find_blocks(lines: list[str], dated: list[bool]) -> list[tuple[int, int]]:
+    """Returns the (start, end) line ranges of the entries of the page text, separated by blank lines.
+    Blocks with several dates are lists without structure in the html: they are split at their first repeated numbered
+    heading (Jornada 9, Jornada 10) if it comes before the first date, otherwise at every date, with the CONTEXT_LINES
+    lines before it"""
+    blocks = []
+    start = 0
+    for end in [i for i, line in enumerate(lines) if not line.strip()] + [len(lines)]:
+        dates = [i for i in range(start, end) if dated[i]]
+        if len(dates) <= 1:
+            blocks.append((start, end))
+            start = end + 1
+            continue
+
+        # lines that only differ in their numbers have the same shape
+        shapes = {i: re.sub(r"\d+", "#", lines[i].strip()) for i in range(start, end) if not dated[i] and re.search(r"\d", lines[i])}
+        counts = Counter(shapes.values())
+        headings = [i for i in range(start, dates[0]) if counts[shapes.get(i)] > 1]
+        if headings:
+            starts = [start] + [i for i in range(start + 1, end) if shapes.get(i) == shapes[headings[0]]]
+            blocks.extend(zip(starts, starts[1:] + [end]))
+        else:
+            for previous, i, following in zip([start - 1] + dates, dates, dates[1:] + [end]):
+                blocks.append((max(i - CONTEXT_LINES, previous + 1), following))
+        start = end + 1
+    return blocks
+
+
+def reduce_to_window(text: str, today: datetime.date, end_date: datetime.date, url: str = "") -> str:
+    """
+    Keeps only the blocks of the page text with a date or date range overlapping the target interval. Blocks are the
+    entries of the page, see find_blocks. Pages without any date are kept whole.
+    """
+    lines = text.split("\n")
+    line_intervals = [find_intervals(line, today) for line in lines]
+    if not any(line_intervals):
+        return text
+
+    first = today - datetime.timedelta(days=WINDOW_MARGIN_DAYS)
+    last = end_date + datetime.timedelta(days=WINDOW_MARGIN_DAYS)
+    keep = [False] * len(lines)
+    for start, end in find_blocks(lines, [len(intervals) > 0 for intervals in line_intervals]):
+        if any(a <= last and b >= first for intervals in line_intervals[start:end] for a, b in intervals):
+            for i in range(start, end):
+                keep[i] = True
+
+    # blank lines are kept so the entries stay apart
+    reduced = "\n".join(line for line, kept in zip(lines, keep) if kept or not line.strip())
+    reduced = re.sub(r"\n{3,}", "\n\n", reduced).strip()
+    tokens_before, tokens_after = len(text) // CHARS_PER_TOKEN, len(reduced) // CHARS_PER_TOKEN
+    print(f"Reduced {url} from ~{tokens_before} to ~{tokens_after} tokens (~{tokens_before - tokens_after} saved).")
+    return reduced
+
+async def scrape_and_extract(context: BrowserContext, url: str, event_webs: List[str], festius_webs: List[str], more_info: Dict[str, str], today: datetime.date, end_date: datetime.date, limiter: TokenBucket, semaphore: asyncio.Semaphore, cache: ExtractionCache) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Scrapes a single URL and extracts its events or festius as soon as the page is scraped.
+    Returns the events and the festius found
+    """
+    text = await scrape_web_with_context(context, url)
+    text = reduce_to_window(text, today, end_date, url)
+    url_specific_info = more_info.get(url, "No additional information") # Get added personalized info for url
+
+    if not (text and text.strip()):
+        print(f"Skipping extraction for {url} due to empty or stripped content.")
+        return [], []
+
+    if url in event_webs:
+        return await extract_events(text, today, end_date, url_specific_info, limiter, semaphore, cache), []
+    elif url in festius_webs:
+        return [], await extract_festius(text, today, end_date, url_specific_info, limiter, semaphore, cache)
+    return [], []
 
 async def scrape_and_extract_all(event_webs: List[str], festius_webs: List[str], more_info: Dict[str, str], today: datetime.date, end_date: datetime.date, should_extract_events: bool, should_extract_festius: bool) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     """
-    Orchestrates browser launch and concurrently runs all scraping tasks.
+    Orchestrates browser launch and concurrently runs all scraping tasks. Each page is sent to the LLM as soon as it is
+    scraped, with the requests limited to the API quota.
     """
+    from playwright.async_api import async_playwright
     
     all_urls: list[str] = []
     
@@ -217,34 +562,27 @@ async def scrape_and_extract_all(event_webs: List[str], festius_webs: List[str],
             viewport={'width': 1280, 'height': 800}
         )
         
-        all_scrape_tasks = []
+        limiter = TokenBucket(LLM_REQUESTS_PER_MINUTE / 60)
+        semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        cache = ExtractionCache()
+
+        all_tasks = []
         for url in all_urls:
-            all_scrape_tasks.append(
-                scrape_web_with_context(context, url)
+            all_tasks.append(
+                scrape_and_extract(context, url, event_webs, festius_webs, more_info, today, end_date, limiter, semaphore, cache)
             )
 
-        scraped_texts = await asyncio.gather(*all_scrape_tasks) # Runs all tasks in list concurrently
+        results = await asyncio.gather(*all_tasks) # Runs all tasks in list concurrently
 
         await browser.close()
-        print("Scraping complete.")
+        cache.save()
+        print("Scraping and extraction complete.")
 
         events_list = []
         festius_list = []
-        
-        for i, text in enumerate(scraped_texts):
-            url = all_urls[i]
-            url_specific_info = more_info.get(url, "No additional information") # Get added personalized info for url
-
-            if text and text.strip():
-                if url in event_webs:
-                    url_events = extract_events(text, today, end_date, url_specific_info)
-                    events_list.extend(url_events)
-                elif url in festius_webs:
-                    url_events = extract_festius(text, today, end_date, url_specific_info)
-                    festius_list.extend(url_events)
-                time.sleep(12.1)
-            else:
-                print(f"Skipping extraction for {url} due to empty or stripped content.")
+        for url_events, url_festius in results:
+            events_list.extend(url_events)
+            festius_list.extend(url_festius)
 
         return events_list, festius_list
 
@@ -311,3 +649,4 @@ def scrape_week_ahead(end_date: datetime.date = None, should_extract_events=True
     print(df_festius.to_markdown(index=False))
     
     return df_events, df_festius
+
@@ -2,47 +2,92 @@ import os
 import sqlalchemy as sql
 import pandas as pd
 
+DEFAULT_METADATA = pd.DataFrame(
+    {
+        # default values
+        "key": [
+            "encoder_max_len",
+            "last_day_event_checked",
+            "model_accuracy",
+            "model_error_over",
+            "model_error_under",
+            "last_predicted_day",
+            "best_learning_rate",
+            "best_base",
+            "best_depth",
+            "regressor_version",
+            "regressor_manifest",
+        ],
+        "value": [
+            0,
+            "2022-12-31",
+            0,
+            0,
+            0,
+            None,
+            0,
+            0,
+            0,
+            None,
+            None,
+        ],
+    }
+)
+
+
+# key of the PostgreSQL advisory lock taken by every metadata write, so concurrent runs can't interleave their updates
+METADATA_LOCK_KEY = 7301
+
+# keys only written if they still have the value this manager read, so a concurrent run's update is not overwritten
+COMPARE_AND_SET_KEYS = ["last_predicted_day"]
+
 
 class MetadataManager:
     engine: sql.Engine
+    values: dict[str, str | None]
+    loaded: dict[str, str | None]
+    pending: dict[str, str]
 
     def __init__(self, engine: sql.Engine):
-        """Stores engine and creates table if it doesn't exist
+        """Stores engine, creates table if it doesn't exist and loads a snapshot of it.
+        Writes made inside a `with manager:` block are queued and flushed in one transaction when the block exits.
 
         Args:
             engine (sql.Engine): sqlalchemy engine.
         """
         inspector = sql.inspect(engine)
         self.engine = engine
+        self.pending = {}
+        self.depth = 0  # number of nested with blocks
         if not inspector.has_table("metadata"):
-            with self.engine.connect() as conn:
-                pd.DataFrame(
-                    {
-                        # default values
-                        "key": [
-                            "encoder_max_len",
-                            "last_day_event_checked",
-                            "model_accuracy",
-                            "model_error_over",
-                            "model_error_under",
-                            "last_predicted_day",
-                            "best_learning_rate",
-                            "best_base",
-                            "best_depth",
-                        ],
-                        "value": [
-                            0,
-                            "2022-12-31",
-                            0,
-                            0,
-                            0,
-                            None,
-                            0,
-                            0,
-                            0,
-                        ],
-                    }
-                ).to_sql(name="metadata", con=engine, if_exists="fail", index=False)
+            DEFAULT_METADATA.to_sql(name="metadata", con=engine, if_exists="fail", index=False)
+        else:
+            # keys added after the table was created
+            existing = pd.read_sql_query(sql.text("SELECT key FROM metadata"), con=engine)
+            missing = DEFAULT_METADATA[~DEFAULT_METADATA["key"].isin(existing["key"])]
+            if not missing.empty:
+                with self.engine.begin() as conn:
+                    missing.to_sql(name="metadata", con=conn, if_exists="append", index=False)
+        self.refresh()
+
+    def __enter__(self) -> "MetadataManager":
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # writes made before an error are kept, as they were when every set was committed immediately
+        self.depth -= 1
+        if self.depth == 0:
+            self.flush()
+
+    def refresh(self) -> None:
+        """Reloads the snapshot of the metadata table. Queued writes are kept"""
+        with self.engine.connect() as conn:
+            result = conn.execute(sql.text("SELECT key, value FROM metadata")).all()
+        # result is a list of tuples (key, value)
+        self.loaded = {key: value for key, value in result}
+        self.values = dict(self.loaded)
+        self.values.update(self.pending)
 
     def get(self, key: str) -> str | None:
         """Returns the value of the key if found.
@@ -53,18 +98,10 @@ class MetadataManager:
         Returns:
             str | None: Value.
         """
-        with self.engine.connect() as conn:
-            result = conn.execute(
-                sql.text("SELECT * FROM metadata WHERE key=:key"), {"key": key}
-            ).all()
-            if len(result) == 0:
-                return None
-            else:
-                # result is a list of tuples (key, value)
-                return result[0][1]
+        return self.values.get(key)
 
     def set(self, key: str, value: str):
-        """Updates the value of a key.
+        """Updates the value of a key. It is written immediately outside a with block and when the block exits inside one.
 
         Args:
             key (str)
@@ -73,14 +110,44 @@ class MetadataManager:
         Raises:
             Exception: If the key was not found
         """
-        # Execute SQL
-        with self.engine.connect() as conn:
-            result = conn.execute(
-                sql.text("UPDATE metadata SET value = :value WHERE key = :key"),
-                {"key": key, "value": value},
-            )
-            conn.commit()
-
-            # Check if any row was modified
-            if result.rowcount == 0:
-                raise Exception(f"The key {key} was not found in the metadata.")
+        if key not in self.values:
+            raise Exception(f"The key {key} was not found in the metadata.")
+
+        # the table stores text, so the snapshot holds what get would read back
+        self.pending[key] = value
+        self.values[key] = None if value is None else str(value)
+        if self.depth == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes all queued values in a single transaction, holding the metadata advisory lock until it commits.
+        A key in COMPARE_AND_SET_KEYS that another run changed since it was read keeps the other run's value"""
+        if len(self.pending) == 0:
+            return
+
+        params = [{"key": key, "value": value} for key, value in self.pending.items() if key not in COMPARE_AND_SET_KEYS]
+        with self.engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.execute(sql.text("SELECT pg_advisory_xact_lock(:lock_key)"), {"lock_key": METADATA_LOCK_KEY})
+            if params:
+                conn.execute(sql.text("UPDATE metadata SET value = :value WHERE key = :key"), params)
+
+            rejected = []
+            for key in COMPARE_AND_SET_KEYS:
+                if key not in self.pending:
+                    continue
+                expected = self.loaded[key]
+                condition = "value IS NULL" if expected is None else "value = :expected"
+                result = conn.execute(
+                    sql.text(f"UPDATE metadata SET value = :value WHERE key = :key AND {condition}"),
+                    {"key": key, "value": self.pending[key], "expected": expected},
+                )
+                if result.rowcount == 0:
+                    rejected.append(key)
+
+        for key, value in self.pending.items():
+            self.loaded[key] = None if value is None else str(value)
+        self.pending = {}
+        if rejected:
+            print(f"--- Warning: {', '.join(rejected)} changed by another run, its value is kept ---")
+            self.refresh()
@@ -1,9 +1,15 @@
 import requests
+import hashlib
+import numpy as np
 import pandas as pd
 import io
 import os
+import threading
 import dotenv
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 dotenv.load_dotenv()
 
@@ -21,25 +27,55 @@ END_DATE = "2025-08-31"
 API_URL_PAST = "https://archive-api.open-meteo.com/v1/archive"
 API_URL_FUTURE = "https://api.open-meteo.com/v1/forecast"
 
+VARIABLES = ["temperature_2m_max", "temperature_2m_min", "precipitation_sum"]
 
-def daily_weather_summary(
-    lat=LATITUDE, lon=LONGITUDE, start=START_DATE, end=END_DATE
-) -> pd.DataFrame | None:
-    """Obtains historic Barcelona meteorological data (precipitation + temperature)"""
+# local store of every value fetched, keyed by (lat, lon, day, source)
+WEATHER_STORE_PATH = "data/weather_store.csv"
+STORE_COLUMNS = ["lat", "lon", "day", "source", "fetched"] + VARIABLES
+
+# per-barri weather cache, one file per set of barri points
+BARRI_WEATHER_PATH = "data/barri_weather_{}.npz"
+LOCATIONS_PER_REQUEST = 50  # coordinates per multi-location request
+
+ARCHIVE_CHUNK_DAYS = 366  # days per archive request
+ARCHIVE_WORKERS = 4  # archive requests in flight at once
+REQUEST_TIMEOUT = (10, 60)  # seconds to connect and to read
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+_store: pd.DataFrame | None = None
+_store_lock = threading.Lock()
+_barri_weather_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Returns the session shared by all requests, which keeps connections open and retries failed requests"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=4, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+            adapter = HTTPAdapter(pool_maxsize=ARCHIVE_WORKERS, max_retries=retry)
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+        return _session
+
+
+def fetch_weather(url: str, lat: float, lon: float, start: str, end: str) -> pd.DataFrame | None:
+    """Requests the daily weather from start to end (inclusive) to an Open-Meteo API. Returns None on error"""
 
     parametros = {
         "latitude": lat,
         "longitude": lon,
         "start_date": start,
         "end_date": end,
-        "daily": ["temperature_2m_max", "temperature_2m_min", "precipitation_sum"],
+        "daily": VARIABLES,
     }
 
-    response = requests.get(
-        API_URL_PAST,
-        params=parametros,
-        timeout=180,
-    )
+    try:
+        response = get_session().get(url, params=parametros, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"Error obtaining data: {e}")
+        return None
 
     if response.status_code == 200:
         df = pd.DataFrame(response.json()["daily"])
@@ -52,34 +88,255 @@ def daily_weather_summary(
         return None
 
 
+def get_store() -> pd.DataFrame:
+    """Returns the weather store, loading it from disk the first time. Must be called holding _store_lock"""
+    global _store
+    if _store is None:
+        if os.path.exists(WEATHER_STORE_PATH):
+            _store = pd.read_csv(WEATHER_STORE_PATH, parse_dates=["day", "fetched"])
+        else:
+            _store = pd.DataFrame(columns=STORE_COLUMNS)
+    return _store
+
+
+def stored_weather(lat: float, lon: float, days: pd.DatetimeIndex, source: str) -> pd.DataFrame:
+    """Returns the complete stored values of source for the days given"""
+    with _store_lock:
+        store = get_store()
+        mask = (store["lat"] == round(lat, 4)) & (store["lon"] == round(lon, 4)) & (store["source"] == source) & store["day"].isin(days)
+        if source == "forecast":
+            # forecasts change every day, only the ones fetched today are used
+            mask &= store["fetched"] == pd.Timestamp(TODAY.date())
+        return store.loc[mask].dropna(subset=VARIABLES)[["day"] + VARIABLES]
+
+
+def add_to_store(df: pd.DataFrame, lat: float, lon: float, source: str) -> None:
+    """Adds the complete rows of df to the store, replacing older values of the same days. Archive values replace forecasts"""
+    global _store
+    df = df.dropna(subset=VARIABLES).assign(lat=round(lat, 4), lon=round(lon, 4), source=source, fetched=pd.Timestamp(TODAY.date()))
+    if df.empty:
+        return
+
+    with _store_lock:
+        store = get_store()
+        same_place = (store["lat"] == round(lat, 4)) & (store["lon"] == round(lon, 4)) & store["day"].isin(df["day"])
+        replaced = same_place & ((store["source"] == source) | (source == "archive"))
+        _store = pd.concat([store.loc[~replaced], df[STORE_COLUMNS]], ignore_index=True).sort_values(["lat", "lon", "day"], ignore_index=True)
+
+        os.makedirs(os.path.dirname(WEATHER_STORE_PATH), exist_ok=True)
+        _store.to_csv(WEATHER_STORE_PATH, index=False)
+
+
+def missing_ranges(days: pd.DatetimeIndex, max_days: int) -> list[tuple[str, str]]:
+    """Groups the days into (start, end) ranges of consecutive days, of at most max_days each"""
+    ranges: list[tuple[str, str]] = []
+    days = days.sort_values()
+    start = 0
+    for i in range(1, len(days) + 1):
+        if i == len(days) or days[i] - days[i - 1] != timedelta(days=1) or i - start == max_days:
+            ranges.append((days[start].strftime("%Y-%m-%d"), days[i - 1].strftime("%Y-%m-%d")))
+            start = i
+    return ranges
+
+
+def daily_weather_summary(
+    lat=LATITUDE, lon=LONGITUDE, start=START_DATE, end=END_DATE
+) -> pd.DataFrame | None:
+    """Obtains historic Barcelona meteorological data (precipitation + temperature).
+    Only the days not in the store are requested, in chunks fetched in parallel"""
+
+    days = pd.date_range(start, end, freq="D")
+    cached = stored_weather(lat, lon, days, "archive")
+    missing = days.difference(cached["day"])
+
+    if len(missing) > 0:
+        ranges = missing_ranges(missing, ARCHIVE_CHUNK_DAYS)
+        print(f"Fetching {len(missing)} days of archive weather in {len(ranges)} requests")
+        with ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS) as executor:
+            parts = list(executor.map(lambda r: fetch_weather(API_URL_PAST, lat, lon, r[0], r[1]), ranges))
+        if any(part is None for part in parts):
+            return None
+
+        fetched = pd.concat(parts, ignore_index=True)
+        add_to_store(fetched, lat, lon, "archive")
+        # the archive has no values yet for the last few days, they are returned empty and fetched again next time
+        cached = pd.concat([cached, fetched], ignore_index=True)
+
+    return cached.drop_duplicates(subset="day", keep="last").sort_values("day", ignore_index=True)
+
+
 def weather_forecast_1_week(
     lat=LATITUDE,
     lon=LONGITUDE,
     start=TODAY.strftime("%Y-%m-%d"),
     end=ONE_WEEK.strftime("%Y-%m-%d"),
 ) -> pd.DataFrame | None:
-    """Obtains historic Barcelona meteorological data (precipitation + temperature)"""
+    """Obtains Barcelona meteorological forecast (precipitation + temperature).
+    Days already in the archive use the archive values, and forecasts fetched today are reused"""
 
-    parametros = {
-        "latitude": lat,
-        "longitude": lon,
-        "start_date": start,
-        "end_date": end,
-        "daily": ["temperature_2m_max", "temperature_2m_min", "precipitation_sum"],
-    }
+    days = pd.date_range(start, end, freq="D")
+    archived = stored_weather(lat, lon, days, "archive")
+    cached = pd.concat([archived, stored_weather(lat, lon, days.difference(archived["day"]), "forecast")], ignore_index=True)
+    missing = days.difference(cached["day"])
 
-    response = requests.get(
-        API_URL_FUTURE,
-        params=parametros,
-        timeout=180,
-    )
+    if len(missing) > 0:
+        # the forecast range is short, a single request covers it
+        fetched = fetch_weather(API_URL_FUTURE, lat, lon, missing.min().strftime("%Y-%m-%d"), missing.max().strftime("%Y-%m-%d"))
+        if fetched is None:
+            return None
 
-    if response.status_code == 200:
-        df = pd.DataFrame(response.json()["daily"])
-        df = df.rename(columns={"time": "day"})
-        df["day"] = pd.to_datetime(df["day"])
+        fetched = fetched[fetched["day"].isin(missing)]
+        add_to_store(fetched, lat, lon, "forecast")
+        cached = pd.concat([cached, fetched], ignore_index=True)
+
+    return cached.sort_values("day", ignore_index=True)
+
+
+class BarriWeather:
+    """Daily weather of every barri, stored as an array of shape (days, barris, variables)"""
+
+    def __init__(self, days: pd.DatetimeIndex, barris: list[str], values: np.ndarray):
+        self.days = pd.DatetimeIndex(days)
+        self.barris = list(barris)
+        self.values = values.astype(np.float32)
+
+    @classmethod
+    def load(cls, path: str) -> "BarriWeather":
+        with np.load(path) as data:
+            return cls(pd.to_datetime(data["days"]), data["barris"].tolist(), data["values"])
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path, days=self.days.values.astype("datetime64[D]"), barris=np.array(self.barris), values=self.values)
+
+    def select(self, days: pd.DatetimeIndex) -> "BarriWeather":
+        """Returns the weather of the days given, NaN for the days not stored"""
+        index = self.days.get_indexer(days)
+        values = np.full((len(days),) + self.values.shape[1:], np.nan, dtype=np.float32)
+        values[index >= 0] = self.values[index[index >= 0]]
+        return BarriWeather(days, self.barris, values)
+
+    def join(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Returns df (one row per day and barri) with the weather of each barri in the weather columns.
+        Rows without per-barri values keep the weather they had"""
+        day_index = self.days.get_indexer(pd.to_datetime(df["day"]))
+        barri_index = pd.Index(self.barris).get_indexer(df["barri"].astype(str))
+        found = (day_index >= 0) & (barri_index >= 0)
+        values = np.full((len(df), len(VARIABLES)), np.nan)
+        values[found] = self.values[day_index[found], barri_index[found]]
+
+        df = df.copy()
+        if all(variable in df.columns for variable in VARIABLES):
+            values = np.where(np.isnan(values), df[VARIABLES].to_numpy(dtype=float), values)
+        df[VARIABLES] = values
         return df
-    else:
-        print(f"Error obtaining data. Response status code: {response.status_code}")
-        print(response.text)
+
+
+def points_hash(points: pd.DataFrame) -> str:
+    """Returns a hash of the barri names and coordinates, the per-barri cache is only valid for the same points"""
+    key = points[["nom_barri", "lat", "lon"]].round(4).to_csv(index=False)
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def fetch_weather_points(url: str, lats: np.ndarray, lons: np.ndarray, start: str, end: str) -> np.ndarray | None:
+    """Requests the daily weather of many locations from start to end (inclusive), LOCATIONS_PER_REQUEST per request.
+    Returns an array of shape (days, locations, variables), None on error"""
+
+    values = []
+    for i in range(0, len(lats), LOCATIONS_PER_REQUEST):
+        parametros = {
+            "latitude": ",".join(f"{lat:.4f}" for lat in lats[i : i + LOCATIONS_PER_REQUEST]),
+            "longitude": ",".join(f"{lon:.4f}" for lon in lons[i : i + LOCATIONS_PER_REQUEST]),
+            "start_date": start,
+            "end_date": end,
+            "daily": VARIABLES,
+        }
+
+        try:
+            response = get_session().get(url, params=parametros, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Error obtaining data: {e}")
+            return None
+        if response.status_code != 200:
+            print(f"Error obtaining data. Response status code: {response.status_code}")
+            print(response.text)
+            return None
+
+        # a list with one result per location, or a single result for one location
+        results = response.json()
+        if isinstance(results, dict):
+            results = [results]
+        # missing values come as null, converted to NaN
+        values.extend(np.array([result["daily"][variable] for variable in VARIABLES], dtype=float).T for result in results)
+
+    return np.stack(values, axis=1)
+
+
+def barri_weather_archive(points: pd.DataFrame, start: str, end: str) -> BarriWeather | None:
+    """Obtains the historic weather of every barri point (nom_barri, lat, lon) from start to end (inclusive).
+    Only the days not in the cache are requested, in chunks fetched in parallel"""
+
+    path = BARRI_WEATHER_PATH.format(points_hash(points))
+    days = pd.date_range(start, end, freq="D")
+
+    with _barri_weather_lock:
+        if os.path.exists(path):
+            cache = BarriWeather.load(path)
+        else:
+            cache = BarriWeather(pd.DatetimeIndex([]), points["nom_barri"], np.zeros((0, len(points), len(VARIABLES))))
+        cache = cache.select(cache.days.union(days))
+
+        requested = cache.select(days)
+        missing = days[np.isnan(requested.values).any(axis=(1, 2))]
+        if len(missing) == 0:
+            return requested
+
+        ranges = missing_ranges(missing, ARCHIVE_CHUNK_DAYS)
+        print(f"Fetching {len(missing)} days of archive weather for {len(points)} barris in {len(ranges)} ranges")
+        lats, lons = points["lat"].to_numpy(), points["lon"].to_numpy()
+        with ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS) as executor:
+            parts = list(executor.map(lambda r: fetch_weather_points(API_URL_PAST, lats, lons, r[0], r[1]), ranges))
+        if any(part is None for part in parts):
+            return None
+
+        for (range_start, range_end), part in zip(ranges, parts):
+            index = cache.days.get_indexer(pd.date_range(range_start, range_end, freq="D"))
+            cache.values[index] = part
+        # days the archive has no values for yet stay NaN and are requested again next time
+        cache.save(path)
+        return cache.select(days)
+
+
+def barri_weather_forecast(points: pd.DataFrame, start: str, end: str) -> BarriWeather | None:
+    """Obtains the weather forecast of every barri point (nom_barri, lat, lon) from start to end (inclusive).
+    Days already in the archive cache use the archive values"""
+
+    days = pd.date_range(start, end, freq="D")
+    values = fetch_weather_points(API_URL_FUTURE, points["lat"].to_numpy(), points["lon"].to_numpy(), start, end)
+    if values is None:
         return None
+    weather = BarriWeather(days, points["nom_barri"], values)
+
+    path = BARRI_WEATHER_PATH.format(points_hash(points))
+    with _barri_weather_lock:
+        if os.path.exists(path):
+            archived = BarriWeather.load(path).select(days).values
+            weather.values = np.where(np.isnan(archived), weather.values, archived)
+    return weather
+
+
+def barri_weather_summary(points: pd.DataFrame, start: str, end: str, today: datetime = TODAY) -> BarriWeather | None:
+    """Obtains the weather of every barri point from start to end (inclusive): the archive before today and the forecast from today"""
+
+    start_day, end_day, today_day = pd.Timestamp(start), pd.Timestamp(end), pd.Timestamp(today.date())
+    parts = []
+    if start_day < today_day:
+        parts.append(barri_weather_archive(points, start, min(end_day, today_day - timedelta(days=1)).strftime("%Y-%m-%d")))
+    if end_day >= today_day:
+        parts.append(barri_weather_forecast(points, max(start_day, today_day).strftime("%Y-%m-%d"), end))
+    if any(part is None for part in parts):
+        return None
+
+    days = pd.DatetimeIndex(np.concatenate([part.days.values for part in parts]))
+    return BarriWeather(days, points["nom_barri"], np.concatenate([part.values for part in parts]))
+
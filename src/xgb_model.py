@@ -1,6 +1,16 @@
+from __future__ import annotations
+
+import json
+import os
 import pandas as pd
 import numpy as np
-import xgboost as xgb
+from typing import TYPE_CHECKING
+
+# xgboost imports scikit-learn when it is installed, so it is only imported to train, load or save a model
+if TYPE_CHECKING:
+    import xgboost as xgb
+
+MANIFEST_NAME = "manifest.json"
 
 
 class Multiregressor:
@@ -8,6 +18,7 @@ class Multiregressor:
         self.regressors = []
         self.prediction_length = 0
         self.features = []
+        self.categories = {}  # categories of every categorical feature seen in training
 
     def lr_schedule(round_index) -> float:
         """Defines the following schedule:
@@ -34,6 +45,11 @@ class Multiregressor:
     ) -> None:
         """Creates n XGB regressors with the hyperparameters provided and fits them with the data provided"""
         self.features = X_train.columns
+        self.categories = {
+            column: X_train[column].cat.categories.tolist()
+            for column in X_train.columns
+            if isinstance(X_train[column].dtype, pd.CategoricalDtype)
+        }
 
         for i in range(n):
             print(f"Fitting regressor {i + 1} of {n}")
@@ -50,20 +66,105 @@ class Multiregressor:
             )
 
     def predict(self, X: pd.DataFrame) -> np.array:
-        """Returns the average of all predictions"""
-        prediction = np.zeros(len(X))
-        for model in self.regressors:
-            prediction += model.predict(X) / len(self.regressors)
-        return prediction
+        """Returns the average of all predictions. Every regressor predicts in place on X, without building a DMatrix"""
+        self.check_features(X)
+        if len(X) == 0:
+            return np.zeros(0)
+
+        predictions = np.empty((len(self.regressors), len(X)), dtype=np.float32)
+        for i, model in enumerate(self.regressors):
+            booster = get_booster(model)
+            predictions[i] = booster.inplace_predict(X, iteration_range=iteration_range(booster))
+        return predictions.mean(axis=0, dtype=np.float64)
+
+    def check_features(self, X: pd.DataFrame) -> None:
+        """Raises an exception if the columns of X are not the features the model was trained with, in the same order and with the same types"""
+        if list(X.columns) != list(self.features):
+            raise Exception(f"Feature mismatch: expected {list(self.features)}, got {list(X.columns)}")
+
+        # models pickled before categories were stored do not have the attribute
+        for column in getattr(self, "categories", {}):
+            if not isinstance(X[column].dtype, pd.CategoricalDtype):
+                raise Exception(f"Feature {column} should be categorical, got {X[column].dtype}")
+
+    def save(self, directory: str, version: str, training_window: tuple[str, str]) -> dict:
+        """Saves the booster of every regressor in XGBoost's native format and a manifest describing them in directory. Returns the manifest"""
+        import xgboost as xgb
+
+        os.makedirs(directory, exist_ok=True)
+
+        files = []
+        for i, model in enumerate(self.regressors):
+            files.append(f"regressor_{i}.ubj")
+            get_booster(model).save_model(os.path.join(directory, files[-1]))
+
+        manifest = {
+            "version": version,
+            "features": list(self.features),
+            "categories": self.categories,
+            "ensemble_size": len(self.regressors),
+            "files": files,
+            "training_window": {"start": training_window[0], "end": training_window[1]},
+            "xgboost_version": xgb.__version__,
+        }
+        with open(os.path.join(directory, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+    @staticmethod
+    def load(directory: str, nthread: int = -1) -> "Multiregressor":
+        """Loads a model saved with save, checking that the manifest and the regressors agree. The boosters predict with
+        nthread threads (all of them by default)"""
+        import xgboost as xgb
+
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        if len(manifest["files"]) != manifest["ensemble_size"]:
+            raise Exception(f"Manifest in {directory} lists {len(manifest['files'])} regressors, expected {manifest['ensemble_size']}")
+
+        model = Multiregressor()
+        model.features = manifest["features"]
+        model.categories = manifest["categories"]
+        for file in manifest["files"]:
+            booster = xgb.Booster(params={"nthread": nthread})
+            booster.load_model(os.path.join(directory, file))
+            names_differ = booster.feature_names is not None and booster.feature_names != model.features
+            if booster.num_features() != len(model.features) or names_differ:
+                raise Exception(f"Features of {file} do not match the manifest in {directory}")
+            model.regressors.append(booster)
+        return model
 
     def get_feature_importances(self) -> np.array:
         """Returns the average of all model importances"""
+        import xgboost as xgb
+
         feature_importances = np.zeros(len(self.features))
         for model in self.regressors:
-            feature_importances += model.feature_importances_ / len(self.regressors)
+            if isinstance(model, xgb.Booster):
+                # same importances as XGBRegressor.feature_importances_, boosters without feature names use f0, f1, ...
+                scores = model.get_score(importance_type="gain")
+                importances = np.array([scores.get(feature, scores.get(f"f{i}", 0.0)) for i, feature in enumerate(self.features)])
+                feature_importances += importances / importances.sum() / len(self.regressors)
+            else:
+                feature_importances += model.feature_importances_ / len(self.regressors)
         return feature_importances
 
 
+def get_booster(model: xgb.XGBRegressor | xgb.Booster) -> xgb.Booster:
+    """Returns the booster of a regressor, trained regressors are XGBRegressor and loaded ones are Booster"""
+    import xgboost as xgb
+
+    return model if isinstance(model, xgb.Booster) else model.get_booster()
+
+
+def iteration_range(booster: xgb.Booster) -> tuple[int, int]:
+    """Returns the trees used by XGBRegressor.predict: up to the best iteration if early stopping was used, all of them otherwise"""
+    try:
+        return 0, booster.best_iteration + 1
+    except AttributeError:
+        return 0, 0
+
+
 def create_and_fit_regressor(
     X_train: pd.DataFrame,
     y_train: pd.Series,
@@ -74,6 +175,8 @@ def create_and_fit_regressor(
     depth: int,
 ) -> xgb.XGBRegressor:
     """Creates an XGB regressor with the hyperparameters provided and fits it with the data provided. If learning_rate is None, it uses the predefined schedule. Returns the trained model"""
+    import xgboost as xgb
+
     if learning_rate is None:
         model = xgb.XGBRegressor(
             tree_method="hist",
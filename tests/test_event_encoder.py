@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+keras = pytest.importorskip("keras")
+
+import event_encoder
+
+NUM_CATEGORIES = 6
+MAX_LEN = 10
+
+
+@pytest.fixture(scope="module")
+def encoders():
+    keras.utils.set_random_seed(0)
+    _, encoder = event_encoder.additive_encoder(NUM_CATEGORIES)
+    return encoder, event_encoder.LookupEncoder.from_keras(encoder)
+
+
+def random_events(n: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Random groups of events padded with category 0, impacts from 1 to 5"""
+    rng = np.random.default_rng(seed)
+    X_cat = rng.integers(0, NUM_CATEGORIES, size=(n, MAX_LEN)).astype("int32")
+    X_imp = rng.integers(1, 6, size=(n, MAX_LEN, 1)).astype("float32")
+    X_imp[X_cat == 0] = 0
+    return X_cat, X_imp
+
+
+def test_lookup_matches_keras(encoders):
+    encoder, lookup = encoders
+    assert event_encoder.check_lookup_encoder(encoder, lookup, MAX_LEN) < 1e-4
+
+
+def test_saved_lookup_matches_keras(encoders, tmp_path):
+    encoder, lookup = encoders
+    lookup.save(tmp_path / "encoder_table.npz")
+    loaded = event_encoder.load_encoder(str(tmp_path))
+
+    X_cat, X_imp = random_events(200, seed=1)
+    x = {"input_event": X_cat, "input_impact": X_imp}
+    expected = encoder.predict(x=x, verbose=0)
+    np.testing.assert_allclose(loaded.predict(x), expected, atol=1e-4)
+
+
+def test_impacts_out_of_table_use_the_closest_integer(encoders):
+    encoder, lookup = encoders
+    X_cat, _ = random_events(200, seed=2)
+    X_imp = np.random.default_rng(2).uniform(-2, 8, size=(200, MAX_LEN, 1)).astype("float32")
+
+    rounded = np.clip(np.rint(X_imp), 0, 5)
+    expected = encoder.predict(x={"input_event": X_cat, "input_impact": rounded}, verbose=0)
+    prediction = lookup.predict({"input_event": X_cat, "input_impact": X_imp})
+    np.testing.assert_allclose(prediction, expected, atol=1e-4)
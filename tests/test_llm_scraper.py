@@ -0,0 +1,88 @@
+import datetime
+
+import pytest
+
+import llm_scraper
+
+TODAY = datetime.date(2026, 10, 18)
+END_DATE = datetime.date(2026, 10, 25)
+
+
+def intervals(line: str) -> list[tuple[str, str]]:
+    return [(first.isoformat(), last.isoformat()) for first, last in llm_scraper.find_intervals(line, TODAY)]
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("Del 10 al 30 de octubre de 2026", [("2026-10-10", "2026-10-30")]),
+        ("October 14 - November 2, 2026", [("2026-10-14", "2026-11-02")]),
+        ("Del 28 de diciembre al 3 de enero", [("2026-12-28", "2027-01-03")]),
+        ("14-16 oct. 2026", [("2026-10-14", "2026-10-16")]),
+        ("Dissabte, 24 d'octubre de 2026 - 21:00h", [("2026-10-24", "2026-10-24")]),
+        ("24/10/2026 - 02/11/2026", [("2026-10-24", "2026-11-02")]),
+        ("2026-10-20", [("2026-10-20", "2026-10-20")]),
+    ],
+)
+def test_dates_and_ranges(line, expected):
+    assert intervals(line) == expected
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "FC Barcelona 2-1 Sevilla",
+        "Apertura de puertas 19.30",
+        "Temporada 2026/27",
+        "Tickets may be refunded up to 48 hours before",
+        "Activitats per a tothom, set de propostes al mar",
+        "Obert des de les 10 del matí",
+    ],
+)
+def test_text_without_dates(line):
+    assert intervals(line) == []
+
+
+def test_ranges_overlapping_the_window_are_kept():
+    text = "\n".join([
+        "IBTM World", "Del 10 al 30 de octubre de 2026", "Fira Gran Via",
+        "",
+        "Smart City Expo", "October 14 - November 2, 2026", "Montjuïc",
+        "",
+        "Alimentaria", "Del 2 al 5 de marzo de 2027", "Fira Gran Via",
+    ])
+    reduced = llm_scraper.reduce_to_window(text, TODAY, END_DATE)
+    assert reduced == "\n".join([
+        "IBTM World", "Del 10 al 30 de octubre de 2026", "Fira Gran Via",
+        "",
+        "Smart City Expo", "October 14 - November 2, 2026", "Montjuïc",
+    ])
+
+
+def test_fixture_list_without_structure_is_split_at_its_headings():
+    text = "\n".join([
+        "Calendario",
+        "Jornada 9", "FC Barcelona", "vs", "Sevilla", "Sábado 24 de octubre", "21:00",
+        "Jornada 10", "FC Barcelona", "vs", "Real Madrid", "1 de noviembre", "18:30",
+        "Jornada 8", "Girona", "2-1", "FC Barcelona", "4 de octubre", "16:15",
+    ])
+    reduced = llm_scraper.reduce_to_window(text, TODAY, END_DATE)
+    assert reduced == "\n".join(["Jornada 9", "FC Barcelona", "vs", "Sevilla", "Sábado 24 de octubre", "21:00"])
+
+
+def test_list_items_are_entries():
+    pytest.importorskip("bs4")
+    html = """<body><h1>Calendario</h1><ul>
+        <li><span>Jornada 9</span><div>FC Barcelona</div><div>vs</div><div>Sevilla</div><div>Sábado 24 de octubre</div></li>
+        <li><span>Jornada 10</span><div>FC Barcelona</div><div>vs</div><div>Real Madrid</div><div>1 de noviembre</div></li>
+    </ul></body>"""
+    text = llm_scraper.html_to_text(html)
+    assert text.count("\n\n") == 2
+
+    reduced = llm_scraper.reduce_to_window(text, TODAY, END_DATE)
+    assert reduced == "\n".join(["Jornada 9", "FC Barcelona", "vs", "Sevilla", "Sábado 24 de octubre"])
+
+
+def test_pages_without_dates_are_kept_whole():
+    text = "Sant Jordi\nLlibres i roses a tots els barris"
+    assert llm_scraper.reduce_to_window(text, TODAY, END_DATE) == text